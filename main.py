@@ -3,8 +3,8 @@ import sys
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from src.data_processor import CotacaoProcessor
-from src.optimizer import PortfolioOptimizer
+from src.data_processor import CotacaoProcessor, carregar_metricas
+from src.optimizer import PortfolioOptimizer, otimizar_cenarios
 from src.results_analyzer import ResultsAnalyzer
 from src import config
 
@@ -26,6 +26,7 @@ def menu_principal():
     print("2. Otimizar carteira")
     print("3. Pipeline completo (processar + otimizar + analisar)")
     print("4. Analisar carteira existente")
+    print("5. Otimizar todos os cenários (em paralelo)")
     print("0. Sair")
     print("─"*80)
     
@@ -68,8 +69,7 @@ def otimizar_carteira(metricas=None, cenario='moderado'):
             return None
         
         print(f"\nCarregando métricas: {arquivo_metricas}")
-        import pandas as pd
-        metricas = pd.read_csv(arquivo_metricas, index_col=0)
+        metricas = carregar_metricas(arquivo_metricas)
         print(f"{len(metricas)} ativos carregados")
     
     cfg = config.obter_config(cenario)
@@ -96,6 +96,33 @@ def otimizar_carteira(metricas=None, cenario='moderado'):
         return None
 
 
+def otimizar_todos_cenarios(metricas=None):
+    """Otimiza todos os cenários em paralelo."""
+    print("\n" + "="*80)
+    print("OTIMIZAÇÃO DE TODOS OS CENÁRIOS (PARALELO)")
+    print("="*80)
+    
+    if metricas is None:
+        arquivo_metricas = config.ARQUIVO_METRICAS_CSV
+        if not os.path.exists(arquivo_metricas):
+            print(f"\nMétricas não encontradas: {arquivo_metricas}")
+            print("   Execute primeiro a opção 1 (Processar dados)")
+            return None
+        metricas = carregar_metricas(arquivo_metricas)
+    
+    solucoes = otimizar_cenarios(metricas, ['conservador', 'moderado', 'agressivo'])
+    
+    print("\nResumo dos cenários:")
+    for cenario, solucao in solucoes.items():
+        if solucao is None:
+            print(f"  {cenario.upper():<12} sem solução")
+        else:
+            print(f"  {cenario.upper():<12} {solucao['num_ativos']} ativos, "
+                  f"retorno {solucao['retorno_total']:.2%}, risco {solucao['risco_total']:.4f}")
+    
+    return solucoes, metricas
+
+
 def analisar_resultados(solucao=None, metricas=None, cenario='moderado'):
     """Analisa e visualiza resultados."""
     print("\n" + "="*80)
@@ -113,7 +140,13 @@ def analisar_resultados(solucao=None, metricas=None, cenario='moderado'):
             return
         
         print(f"\nCarregando carteira: {arquivo_carteira}")
-        carteira_df = pd.read_csv(arquivo_carteira)
+        # Cópia Parquet só quando não é mais antiga que o CSV (CSV editado à mão)
+        arquivo_parquet = os.path.splitext(arquivo_carteira)[0] + '.parquet'
+        if (os.path.exists(arquivo_parquet) and
+                os.path.getmtime(arquivo_parquet) >= os.path.getmtime(arquivo_carteira)):
+            carteira_df = pd.read_parquet(arquivo_parquet)
+        else:
+            carteira_df = pd.read_csv(arquivo_carteira)
         
         solucao = {
             'carteira': carteira_df,
@@ -129,7 +162,7 @@ def analisar_resultados(solucao=None, metricas=None, cenario='moderado'):
     if metricas is None:
         arquivo_metricas = config.ARQUIVO_METRICAS_CSV
         if os.path.exists(arquivo_metricas):
-            metricas = pd.read_csv(arquivo_metricas, index_col=0)
+            metricas = carregar_metricas(arquivo_metricas)
         else:
             metricas = solucao['carteira'].set_index('ticker')
     
@@ -191,6 +224,7 @@ def pipeline_completo():
     print()
     print("\nMétricas gerais na pasta 'output/':")
     print("   • metricas_ativos.csv")
+    print("   • metricas_ativos.parquet")
 
 
 def main():
@@ -239,6 +273,9 @@ def main():
             cenario = cenarios.get(escolha_cenario, 'moderado')
             analisar_resultados(cenario=cenario)
         
+        elif escolha == '5':
+            otimizar_todos_cenarios()
+        
         else:
             print("\nOpção inválida")
         
@@ -2,6 +2,10 @@
 Configurações do sistema de otimização de carteiras.
 """
 
+from collections import ChainMap
+from functools import lru_cache
+from types import MappingProxyType
+
 # Processamento de dados
 ARQUIVO_COTAHIST = "data/COTAHIST_A2024.TXT"
 MIN_DIAS_NEGOCIACAO = 200
@@ -19,7 +23,7 @@ MIP_GAP = 0.0
 TOP_N_ATIVOS = 20
 
 
-CENARIO_CONSERVADOR = {
+CENARIO_CONSERVADOR = MappingProxyType({
     'orcamento': 100_000.0,
     'risco_maximo': 0.25,        # 25% de desvio-padrão médio ponderado (conservador)
     'retorno_minimo': 0.08,      # 8% de retorno mínimo
@@ -31,9 +35,9 @@ CENARIO_CONSERVADOR = {
     'num_setores_min': 4,        # Pelo menos 4 setores diferentes
     'max_ativo_pct': 0.20,       # Máximo 20% do orçamento em um único ativo
     'excluir_retorno_negativo': True,  # Não investir em ativos com retorno negativo
-}
+})
 
-CENARIO_MODERADO = {
+CENARIO_MODERADO = MappingProxyType({
     'orcamento': 100_000.0,
     'risco_maximo': 0.35,        # 35% de desvio-padrão médio ponderado (moderado)
     'retorno_minimo': 0.12,      # 12% de retorno mínimo
@@ -44,9 +48,9 @@ CENARIO_MODERADO = {
     'alpha_setor_max': 0.35,     # Máximo 35% em qualquer setor
     'num_setores_min': 3,        # Pelo menos 3 setores diferentes
     'max_ativo_pct': 0.40,       # Máximo 40% do orçamento em um único ativo
-}
+})
 
-CENARIO_AGRESSIVO = {
+CENARIO_AGRESSIVO = MappingProxyType({
     'orcamento': 100_000.0,
     'risco_maximo': 0.50,        # 50% de desvio-padrão médio ponderado (agressivo)
     'retorno_minimo': 0.18,      # 18% de retorno mínimo
@@ -57,39 +61,52 @@ CENARIO_AGRESSIVO = {
     'alpha_setor_max': 1.0,      # Sem limite por setor (pode concentrar)
     'num_setores_min': 2,        # Pelo menos 2 setores diferentes
     'max_ativo_pct': 0.60,       # Máximo 60% do orçamento em um único ativo
-}
+})
+
+
+_CENARIOS = MappingProxyType({
+    'conservador': CENARIO_CONSERVADOR,
+    'moderado': CENARIO_MODERADO,
+    'agressivo': CENARIO_AGRESSIVO,
+})
+
+# Parâmetros comuns a todos os cenários (têm precedência sobre o cenário)
+_PARAMETROS_COMUNS = MappingProxyType({
+    'time_limit': TIME_LIMIT,
+    'mip_gap': MIP_GAP,
+    'top_n_ativos': TOP_N_ATIVOS,
+})
 
 
 def obter_config(cenario='moderado'):
-    """Retorna configuração do cenário escolhido."""
-    cenarios = {
-        'conservador': CENARIO_CONSERVADOR,
-        'moderado': CENARIO_MODERADO,
-        'agressivo': CENARIO_AGRESSIVO,
-    }
+    """Retorna configuração do cenário escolhido.
     
-    config = cenarios.get(cenario.lower(), CENARIO_MODERADO).copy()
-    config.update({
-        'time_limit': TIME_LIMIT,
-        'mip_gap': MIP_GAP,
-        'top_n_ativos': TOP_N_ATIVOS,
-        'cenario_nome': cenario.lower(),
-    })
-    
-    return config
+    Os cenários são imutáveis; alterações no mapeamento retornado ficam
+    apenas na camada local do ChainMap.
+    """
+    return ChainMap(
+        {'cenario_nome': cenario.lower()},
+        _PARAMETROS_COMUNS,
+        _CENARIOS.get(cenario.lower(), CENARIO_MODERADO),
+    )
 
 
+@lru_cache(maxsize=None)
 def obter_diretorios_cenario(cenario='moderado'):
-    """Retorna caminhos de arquivos para o cenário específico."""
+    """Retorna caminhos de arquivos para o cenário específico.
+    
+    O diretório é criado apenas na primeira chamada de cada cenário.
+    """
     import os
     
     cenario_dir = f"output/{cenario.lower()}/"
     os.makedirs(cenario_dir, exist_ok=True)
     
-    return {
+    return MappingProxyType({
         'dir': cenario_dir,
         'carteira_csv': f"{cenario_dir}carteira_otimizada.csv",
+        'carteira_mst': f"{cenario_dir}carteira_otimizada.mst",
         'relatorio_txt': f"{cenario_dir}relatorio_otimizacao.txt",
         'grafico_png': f"{cenario_dir}resultados_carteira.png",
         'analise_xlsx': f"{cenario_dir}analise_completa.xlsx",
-    }
+    })
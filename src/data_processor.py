@@ -2,8 +2,136 @@
 Processador de dados históricos da B3 (COTAHIST).
 """
 
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+from numba import njit, prange
+from tqdm import tqdm
+
+# Ações ON/PN/PNA/PNB/Units do mercado à vista (ex.: PETR4, TAEE11)
+_TICKER_RE = re.compile(r'^[A-Z]{4}(?:3|4|5|6|11)$')
+
+# Campos do layout COTAHIST efetivamente usados pelo pipeline; os demais
+# não são extraídos
+_CAMPOS_UTILIZADOS = frozenset({
+    'data_pregao', 'cod_bdi', 'ticker', 'nome_empresa',
+    'preco_abertura', 'preco_maximo', 'preco_minimo', 'preco_medio', 'preco_ultimo',
+    'volume_total', 'quantidade_negociada', 'total_negocios',
+})
+
+# Tipo de registro '01' (cotação) lido como um único uint16, para comparar
+# os 2 primeiros bytes de cada registro numa só operação
+_REGISTRO_COTACAO = np.frombuffer(b'01', dtype=np.uint16)[0]
+
+# Campos de preço contíguos e de mesma largura no layout COTAHIST
+_CAMPOS_PRECO = ('preco_abertura', 'preco_maximo', 'preco_minimo', 'preco_medio', 'preco_ultimo')
+
+
+@njit(parallel=True, cache=True)
+def _estatisticas_ativos(precos, dias_anualizacao):
+    """Média, desvio-padrão e Sharpe anualizados dos retornos log de cada coluna.
+    
+    Percorre a matriz de preços (dias × ativos) uma única vez por ativo com o
+    algoritmo de Welford, ignorando retornos em que algum dos preços é NaN.
+    Os acumuladores são float64 mesmo quando a matriz é float32.
+    """
+    T, N = precos.shape
+    retorno = np.empty(N)
+    desvio = np.empty(N)
+    sharpe = np.empty(N)
+    for j in prange(N):
+        n = 0
+        media = 0.0
+        m2 = 0.0
+        for t in range(1, T):
+            r = np.log(precos[t, j] / precos[t - 1, j])
+            if np.isnan(r):
+                continue
+            n += 1
+            delta = r - media
+            media += delta / n
+            m2 += delta * (r - media)
+        retorno[j] = media * dias_anualizacao if n > 0 else np.nan
+        desvio[j] = np.sqrt(m2 / (n - 1) * dias_anualizacao) if n > 1 else np.nan
+        sharpe[j] = retorno[j] / desvio[j]
+    return retorno, desvio, sharpe
+
+
+def _campo_texto(campo):
+    """Converte um campo de largura fixa (bytes) em texto sem espaços."""
+    return np.char.decode(np.char.strip(campo), 'latin1')
+
+
+def _campo_categorico(campo):
+    """Converte um campo de largura fixa em Categorical decodificando só os valores distintos."""
+    valores, codigos = np.unique(campo, return_inverse=True)
+    return pd.Categorical.from_codes(codigos.ravel(), categories=_campo_texto(valores))
+
+
+def _campo_numerico(campo):
+    """Converte um campo numérico de largura fixa (preenchido com zeros) em inteiros."""
+    try:
+        return campo.astype(np.int64)
+    except ValueError:
+        valores = pd.to_numeric(pd.Series(_campo_texto(campo.ravel())), errors='coerce')
+        return valores.to_numpy().reshape(campo.shape)
+
+
+@lru_cache(maxsize=None)
+def _carregar_mapa_setores(arquivo_setores):
+    """Lê setores.csv uma única vez e retorna o dicionário prefixo/ticker -> setor."""
+    df_setores = pd.read_csv(arquivo_setores, header=None, names=['setor', 'prefixo'])
+    return dict(zip(df_setores['prefixo'].str.strip(), df_setores['setor'].str.strip()))
+
+
+def _fatiar_registros(bloco, colunas_spec, campos_numericos):
+    """Seleciona os registros de cotação ('01') de um bloco e fatia seus campos.
+    
+    Campos numéricos já saem convertidos; os demais ficam como bytes de
+    largura fixa para serem decodificados após a junção dos blocos.
+    """
+    tipo_registro = np.ascontiguousarray(bloco[:, 0:2]).view(np.uint16).ravel()
+    bloco = bloco[tipo_registro == _REGISTRO_COTACAO]
+    
+    # Os preços formam um único bloco de bytes (registros × campos) e são
+    # convertidos de uma vez
+    posicoes = {nome: (inicio, fim) for nome, inicio, fim in colunas_spec}
+    inicio, fim = posicoes[_CAMPOS_PRECO[0]][0], posicoes[_CAMPOS_PRECO[-1]][1]
+    largura = (fim - inicio) // len(_CAMPOS_PRECO)
+    bloco_precos = np.ascontiguousarray(bloco[:, inicio:fim]).view(f'S{largura}')
+    campos = dict(zip(_CAMPOS_PRECO, (_campo_numerico(bloco_precos) / 100).T))
+    
+    for nome, inicio, fim in colunas_spec:
+        if nome in campos:
+            continue
+        campo = np.ascontiguousarray(bloco[:, inicio:fim]).view(f'S{fim - inicio}').ravel()
+        if nome in campos_numericos:
+            campo = _campo_numerico(campo) / campos_numericos[nome]
+        campos[nome] = campo
+    return campos
+
+
+def carregar_metricas(arquivo=None):
+    """Carrega métricas salvas, preferindo a cópia Parquet ao CSV."""
+    if arquivo is None:
+        from . import config
+        arquivo = config.ARQUIVO_METRICAS_CSV
+    
+    arquivo_parquet = os.path.splitext(arquivo)[0] + '.parquet'
+    if os.path.exists(arquivo_parquet) and (
+            not os.path.exists(arquivo) or
+            os.path.getmtime(arquivo_parquet) >= os.path.getmtime(arquivo)):
+        return pd.read_parquet(arquivo_parquet)
+    
+    metricas = pacsv.read_csv(arquivo).to_pandas()
+    return metricas.set_index(metricas.columns[0])
 
 
 class CotacaoProcessor:
@@ -13,8 +141,10 @@ class CotacaoProcessor:
         self.arquivo_cotahist = arquivo_cotahist
         self.df_completo = None
         self.df_acoes = None
+        self.df_precos = None
         self.df_retornos = None
         self.metricas = None
+        self.covariancia = None
         
     def processar_cotahist(self):
         """Lê e processa arquivo COTAHIST da B3."""
@@ -31,49 +161,103 @@ class CotacaoProcessor:
             ('fator_cotacao', 210, 217), ('preco_exercicio_pontos', 217, 230),
             ('isin', 230, 242), ('distribuicao', 242, 245)
         ]
+        colunas_spec = [campo for campo in colunas_spec if campo[0] in _CAMPOS_UTILIZADOS]
+        
+        # Cache Parquet ao lado do arquivo texto, válido enquanto for mais
+        # recente que o COTAHIST
+        arquivo_cache = os.path.splitext(self.arquivo_cotahist)[0] + '.parquet'
+        if (os.path.exists(arquivo_cache) and
+                os.path.getmtime(self.arquivo_cotahist) < os.path.getmtime(arquivo_cache)):
+            print(f"Carregando cache {arquivo_cache}...")
+            df = pd.read_parquet(arquivo_cache, columns=[nome for nome, _, _ in colunas_spec])
+            print(f"Total: {len(df):,} registros")
+            self.df_completo = df
+            return df
         
-        dados = []
         print(f"Processando arquivo {self.arquivo_cotahist}...")
         
-        with open(self.arquivo_cotahist, 'r', encoding='latin1') as f:
-            for linha_num, linha in enumerate(f, 1):
-                if linha.startswith('00') or linha.startswith('99'):
-                    continue
-                
-                if linha.startswith('01'):
-                    registro = {nome: linha[inicio:fim].strip() 
-                               for nome, inicio, fim in colunas_spec}
-                    dados.append(registro)
-                
-                if linha_num % 100000 == 0:
-                    print(f"  {linha_num:,} linhas processadas...")
-        
-        print(f"Total: {len(dados):,} registros")
-        
-        df = pd.DataFrame(dados)
-        df['data_pregao'] = pd.to_datetime(df['data_pregao'], format='%Y%m%d')
-        
-        campos_preco = ['preco_abertura', 'preco_maximo', 'preco_minimo', 
-                       'preco_medio', 'preco_ultimo']
-        for campo in campos_preco:
-            df[campo] = pd.to_numeric(df[campo], errors='coerce') / 100
-        
-        df['volume_total'] = pd.to_numeric(df['volume_total'], errors='coerce') / 100
-        df['quantidade_negociada'] = pd.to_numeric(df['quantidade_negociada'], errors='coerce')
-        df['total_negocios'] = pd.to_numeric(df['total_negocios'], errors='coerce')
-        df['ticker'] = df['ticker'].str.strip()
-        df['nome_empresa'] = df['nome_empresa'].str.strip()
+        # O COTAHIST tem registros de tamanho fixo: o arquivo é mapeado em
+        # memória como uma matriz (registros × bytes) e cada campo vira uma
+        # fatia de colunas dessa matriz, sem laço Python por linha
+        conteudo = np.memmap(self.arquivo_cotahist, dtype=np.uint8, mode='r')
+        tamanho_linha = int(np.argmax(conteudo[:512] == ord('\n'))) + 1
+        num_linhas = conteudo.size // tamanho_linha
+        registros = conteudo[:num_linhas * tamanho_linha].reshape(num_linhas, tamanho_linha)
+        if tamanho_linha < 245 or not (registros[:, -1] == ord('\n')).all():
+            raise ValueError(f"Layout COTAHIST inválido: {self.arquivo_cotahist}")
+        
+        campos_numericos = {
+            'preco_abertura': 100, 'preco_maximo': 100, 'preco_minimo': 100,
+            'preco_medio': 100, 'preco_ultimo': 100, 'volume_total': 100,
+            'quantidade_negociada': 1, 'total_negocios': 1,
+        }
+        # Colunas de texto repetitivas como Categorical: groupby/pivot passam
+        # a operar sobre códigos inteiros em vez de strings
+        colunas_categoricas = {'ticker', 'cod_bdi', 'nome_empresa', 'data_pregao'}
+        
+        # Blocos de ~100 mil registros processados em paralelo: as operações
+        # do NumPy liberam o GIL e a leitura das páginas do arquivo se
+        # sobrepõe ao cálculo. O progresso é atualizado uma vez por bloco.
+        blocos = np.array_split(registros, max(1, num_linhas // 100_000))
+        partes = []
+        with ThreadPoolExecutor(max_workers=min(len(blocos), os.cpu_count() or 1)) as executor, \
+                tqdm(total=num_linhas, unit=' registros', unit_scale=True) as progresso:
+            resultados = executor.map(
+                partial(_fatiar_registros, colunas_spec=colunas_spec,
+                        campos_numericos=campos_numericos),
+                blocos
+            )
+            for bloco, parte in zip(blocos, resultados):
+                partes.append(parte)
+                progresso.update(len(bloco))
+        
+        colunas = {}
+        for nome, _, _ in colunas_spec:
+            campo = np.concatenate([parte[nome] for parte in partes])
+            if nome in campos_numericos:
+                colunas[nome] = campo
+            elif nome in colunas_categoricas:
+                colunas[nome] = _campo_categorico(campo)
+            else:
+                colunas[nome] = _campo_texto(campo)
+        
+        df = pd.DataFrame(colunas)
+        del partes, blocos, registros, conteudo
+        
+        print(f"Total: {len(df):,} registros")
+        
+        # Datas convertidas uma vez por pregão distinto
+        datas = df['data_pregao'].cat
+        df['data_pregao'] = pd.to_datetime(
+            datas.categories, format='%Y%m%d'
+        )[datas.codes.to_numpy()]
         df = df.sort_values(['data_pregao', 'ticker'])
         
+        df.to_parquet(arquivo_cache, compression='zstd')
+        print(f"Cache salvo: {arquivo_cache}")
+        
         self.df_completo = df
         return df
     
     def filtrar_acoes_principais(self, min_dias_negociacao=200, min_volume_medio=1000000):
         """Filtra ações com liquidez mínima."""
-        df_acoes = self.df_completo[self.df_completo['cod_bdi'] == '02'].copy()
-        df_acoes = df_acoes[df_acoes['ticker'].str.match(r'^[A-Z]{4}(3|4|5|6|11)$')]
+        df = self.df_completo
         
-        liquidez = df_acoes.groupby('ticker').agg({
+        # Regex avaliada uma vez por ticker distinto (categorias) e propagada
+        # às linhas pelos códigos do Categorical
+        tickers = df['ticker'].cat
+        validos = pc.match_substring_regex(
+            pa.array(tickers.categories.to_numpy(dtype=object), type=pa.string()),
+            _TICKER_RE.pattern
+        ).to_numpy(zero_copy_only=False)
+        mascara = (df['cod_bdi'] == '02').to_numpy() & validos[tickers.codes.to_numpy()]
+        
+        # Só as colunas da análise de liquidez são materializadas aqui; o
+        # quadro completo é recortado uma única vez, já com o filtro final
+        colunas_liquidez = ['ticker', 'data_pregao', 'volume_total', 'total_negocios']
+        df_acoes = df.loc[mascara, colunas_liquidez]
+        
+        liquidez = df_acoes.groupby('ticker', observed=True).agg({
             'data_pregao': 'count',
             'volume_total': 'mean',
             'total_negocios': 'mean'
@@ -88,7 +272,9 @@ class CotacaoProcessor:
             (liquidez['volume_medio'] >= min_volume_medio)
         ].index
         
-        df_acoes = df_acoes[df_acoes['ticker'].isin(ativos_liquidos)]
+        mascara &= df['ticker'].isin(ativos_liquidos).to_numpy()
+        df_acoes = df[mascara]
+        df_acoes = df_acoes.assign(ticker=df_acoes['ticker'].cat.remove_unused_categories())
         
         print(f"\nAções filtradas: {df_acoes['ticker'].nunique()} ativos únicos")
         print(f"Critérios: ≥{min_dias_negociacao} dias, volume ≥R$ {min_volume_medio:,.0f}")
@@ -100,15 +286,30 @@ class CotacaoProcessor:
         """Calcula retornos logarítmicos diários."""
         print("\nCalculando retornos...")
         
-        df_precos = self.df_acoes.pivot(
-            index='data_pregao',
-            columns='ticker',
-            values='preco_ultimo'
+        # Matriz dias × ativos montada por indexação direta: linha pelo
+        # pregão, coluna pelo código Categorical do ticker
+        datas, idx_data = np.unique(self.df_acoes['data_pregao'].to_numpy(), return_inverse=True)
+        tickers = self.df_acoes['ticker'].cat
+        
+        # Preços e retornos diários em float32: metade do tráfego de memória
+        # nas reduções; as métricas são acumuladas e salvas em float64
+        precos = np.full((datas.size, tickers.categories.size), np.nan, dtype=np.float32)
+        precos[idx_data.ravel(), tickers.codes.to_numpy()] = self.df_acoes['preco_ultimo'].to_numpy(np.float32)
+        df_precos = pd.DataFrame(
+            precos,
+            index=pd.DatetimeIndex(datas, name='data_pregao'),
+            columns=pd.Index(tickers.categories, name='ticker')
         )
         
-        df_retornos = np.log(df_precos / df_precos.shift(1))
+        log_precos = np.log(precos, out=np.empty_like(precos))
+        df_retornos = pd.DataFrame(
+            np.diff(log_precos, axis=0),
+            index=df_precos.index[1:],
+            columns=df_precos.columns
+        )
         df_retornos = df_retornos.dropna(how='all')
         
+        self.df_precos = df_precos
         self.df_retornos = df_retornos
         print(f"Retornos: {df_retornos.shape[0]} dias × {df_retornos.shape[1]} ativos")
         
@@ -118,46 +319,62 @@ class CotacaoProcessor:
         """Calcula métricas de risco-retorno para cada ativo."""
         print("\nCalculando métricas...")
         
-        metricas = pd.DataFrame(index=self.df_retornos.columns)
-        metricas['retorno_esperado'] = self.df_retornos.mean() * dias_anualizacao
-        metricas['desvio_padrao'] = self.df_retornos.std() * np.sqrt(dias_anualizacao)
-        metricas['sharpe_ratio'] = metricas['retorno_esperado'] / metricas['desvio_padrao']
-        metricas['preco_atual'] = self.df_acoes.groupby('ticker')['preco_ultimo'].last()
-        metricas['volume_medio'] = self.df_acoes.groupby('ticker')['volume_total'].mean()
-        metricas['nome_empresa'] = self.df_acoes.groupby('ticker')['nome_empresa'].first()
+        precos = self.df_precos.to_numpy(np.float32, copy=False)
+        retorno, desvio, sharpe = _estatisticas_ativos(precos, float(dias_anualizacao))
+        
+        metricas = pd.DataFrame({
+            'retorno_esperado': retorno,
+            'desvio_padrao': desvio,
+            'sharpe_ratio': sharpe,
+        }, index=self.df_precos.columns)
+        resumo = self.df_acoes.groupby('ticker', sort=False, observed=True).agg(
+            preco_atual=('preco_ultimo', 'last'),
+            volume_medio=('volume_total', 'mean'),
+            nome_empresa=('nome_empresa', 'first')
+        )
+        metricas = metricas.join(resumo)
         metricas = metricas.dropna()
         
+        # Tabela final com rótulos simples (sem Categorical) para exportação
+        metricas.index = metricas.index.astype(str)
+        metricas['nome_empresa'] = metricas['nome_empresa'].astype(str)
+        
         self.metricas = metricas
         print(f"Métricas calculadas: {len(metricas)} ativos")
         
         return metricas
     
-    def classificar_setores(self):
-        """Classifica ativos por setor usando arquivo setores.csv."""
-        import os
+    def calcular_covariancia(self, dias_anualizacao=252):
+        """Calcula a matriz de covariância anualizada dos retornos (ordem de self.metricas)."""
+        print("\nCalculando covariância...")
         
-        arquivo_setores = 'data/setores.csv'
+        retornos = self.df_retornos[self.metricas.index].to_numpy(np.float32)
+        validos = ~np.isnan(retornos)
+        
+        # Retornos centrados com dias ausentes zerados: o produto C^T C e a
+        # contagem de dias em comum por par saem de duas multiplicações de
+        # matrizes (BLAS), sem laço sobre pares de ativos
+        centrados = np.where(validos, retornos - np.nanmean(retornos, axis=0), 0).astype(np.float32)
+        dias_comuns = validos.astype(np.float32)
+        dias_comuns = dias_comuns.T @ dias_comuns
         
-        # Carregar mapeamento de setores do CSV
-        df_setores = pd.read_csv(arquivo_setores, header=None, names=['setor', 'prefixo'])
+        covariancia = (centrados.T @ centrados) / np.maximum(dias_comuns - 1, 1) * dias_anualizacao
         
-        # Criar dicionário prefixo -> setor
-        mapa_setores = {}
-        for _, row in df_setores.iterrows():
-            prefixo = row['prefixo'].strip()
-            setor = row['setor'].strip()
-            mapa_setores[prefixo] = setor
+        self.covariancia = covariancia
+        print(f"Covariância: {covariancia.shape[0]} × {covariancia.shape[1]}")
         
-        # Classificar cada ativo
-        def obter_setor(ticker):
-            # Tentar buscar com ticker completo primeiro (para casos como EMBR3, BRFS3)
-            if ticker in mapa_setores:
-                return mapa_setores[ticker]
-            # Se não encontrar, tentar com os 4 primeiros caracteres (padrão)
-            prefixo = ticker[:4]
-            return mapa_setores.get(prefixo, 'Outros')
+        return covariancia
+    
+    def classificar_setores(self):
+        """Classifica ativos por setor usando arquivo setores.csv."""
+        arquivo_setores = 'data/setores.csv'
+        mapa_setores = _carregar_mapa_setores(arquivo_setores)
         
-        self.metricas['setor'] = self.metricas.index.map(obter_setor)
+        # Ticker completo tem prioridade (casos como EMBR3, BRFS3); senão,
+        # usa os 4 primeiros caracteres (padrão)
+        tickers = self.metricas.index.to_series()
+        setor = tickers.map(mapa_setores).fillna(tickers.str[:4].map(mapa_setores))
+        self.metricas['setor'] = setor.fillna('Outros')
         
         print(f"\nDistribuição por setor:")
         dist = self.metricas['setor'].value_counts()
@@ -167,13 +384,16 @@ class CotacaoProcessor:
         return self.metricas
     
     def salvar_metricas(self, arquivo=None):
-        """Salva métricas em arquivo CSV."""
+        """Salva métricas em arquivo CSV (e cópia Parquet para recarga rápida)."""
         if arquivo is None:
             from . import config
             arquivo = config.ARQUIVO_METRICAS_CSV
         
         if self.metricas is not None:
             self.metricas.to_csv(arquivo, encoding='utf-8-sig')
+            self.metricas.to_parquet(os.path.splitext(arquivo)[0] + '.parquet')
+            if self.covariancia is not None:
+                np.save(os.path.splitext(arquivo)[0] + '_covariancia.npy', self.covariancia)
             print(f"\nMétricas salvas: {arquivo}")
     
     def executar_pipeline_completo(self, min_dias=200, min_volume=1000000):
@@ -186,6 +406,7 @@ class CotacaoProcessor:
         self.filtrar_acoes_principais(min_dias, min_volume)
         self.calcular_retornos()
         self.calcular_metricas()
+        self.calcular_covariancia()
         self.classificar_setores()
         self.salvar_metricas()
         
@@ -3,9 +3,59 @@ Otimizador de carteiras usando modelo de mochila robusto (Gurobi).
 Baseado em Morita et al. (1989).
 """
 
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import gurobipy as gp
 from gurobipy import GRB
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import scipy.sparse as sp
+
+# Parâmetros fixos do Gurobi (busca do ótimo global), aplicados no ambiente
+_PARAMETROS_SOLVER = {
+    'MIPGapAbs': 0.0,           # Gap absoluto = 0
+    'OptimalityTol': 1e-9,      # Tolerância de otimalidade
+    'IntFeasTol': 1e-9,         # Tolerância de integralidade
+    'FeasibilityTol': 1e-9,     # Tolerância de viabilidade
+    'Presolve': 2,              # Presolve agressivo
+    'OutputFlag': 1,
+}
+
+
+# Ambiente Gurobi do processo (uma licença), criado na primeira otimização
+_AMBIENTE = None
+
+
+def _ambiente():
+    """Ambiente Gurobi compartilhado pelos modelos deste processo.
+    
+    Criado uma única vez com os parâmetros fixos de _PARAMETROS_SOLVER;
+    cada processo de otimizar_cenarios tem o seu.
+    """
+    global _AMBIENTE
+    if _AMBIENTE is None:
+        _AMBIENTE = gp.Env(params=_PARAMETROS_SOLVER)
+    return _AMBIENTE
+
+
+def _regime_parametros(n):
+    """Escolhe parâmetros do Gurobi pelo número de ativos do modelo.
+    
+    Modelos pequenos são limitados por CPU (raiz e ramificação): cortes
+    agressivos compensam. Modelos grandes são limitados por memória: menos
+    cortes, presolve leve e árvore B&B despejada em disco.
+    """
+    if n < 500:
+        return "pequeno (limitado por CPU)", {'Method': -1, 'Cuts': 2, 'Presolve': 2}
+    if n < 5000:
+        return "médio", {'Method': 2, 'Cuts': 1}
+    return "grande (limitado por memória)", {
+        'Method': 2, 'Cuts': 0, 'Presolve': 1, 'NodefileStart': 0.5,
+    }
 
 
 class PortfolioOptimizer:
@@ -17,20 +67,36 @@ class PortfolioOptimizer:
         self.model = None
         self.x_vars = None
         self.y_vars = None  # Agora representa quantidade de lotes/ações
+        self.I_tot = None   # Investimento total (Σ preço × quantidade)
         self.solucao = None
         
+        # Colunas usadas pelo modelo convertidas uma única vez para NumPy
+        # (cópias graváveis: o gurobipy rejeita buffers somente-leitura)
+        self._mu = metricas_df['retorno_esperado'].to_numpy(dtype=float, copy=True)
+        self._sigma = metricas_df['desvio_padrao'].to_numpy(dtype=float, copy=True)
+        self._preco = metricas_df['preco_atual'].to_numpy(dtype=float, copy=True)
+        self._setores, codigo_setor = np.unique(
+            metricas_df['setor'].to_numpy(), return_inverse=True
+        )
+        self._codigo_setor = codigo_setor.ravel()
+        
+        # Ambiente Gurobi único por processo; os modelos criados nele herdam
+        # os parâmetros comuns
+        self.env = _ambiente()
+        
     def construir_modelo(self):
         """Constrói modelo MILP no Gurobi."""
         print("\n" + "="*60)
         print("CONSTRUINDO MODELO")
         print("="*60)
         
-        self.model = gp.Model("Portfolio_Optimization")
+        self.model = gp.Model("Portfolio_Optimization", env=self.env)
+        # Parâmetros do cenário ficam no modelo (o ambiente é compartilhado)
+        self.model.Params.TimeLimit = self.config.get('time_limit', 300)
+        self.model.Params.MIPGap = self.config.get('mip_gap', 0.0)   # 0.0 = buscar ótimo global
         
-        I = self.metricas.index.tolist()
-        mu = self.metricas['retorno_esperado'].to_dict()
-        sigma = self.metricas['desvio_padrao'].to_dict()
-        preco = self.metricas['preco_atual'].to_dict()  # Preço por ação/lote
+        n = len(self.metricas)
+        mu, sigma, preco = self._mu, self._sigma, self._preco  # preço por ação/lote
         
         B = self.config['orcamento']
         R = self.config['risco_maximo']
@@ -43,61 +109,57 @@ class PortfolioOptimizer:
         print(f"  Risco máximo: {R:.4f}")
         print(f"  Retorno mínimo: {T:.2%}")
         print(f"  Ativos: [{L_min}, {L_max}]")
-        print(f"  Disponíveis: {len(I)}")
+        print(f"  Disponíveis: {n}")
         
-        # Variáveis de decisão
-        self.x_vars = self.model.addVars(I, vtype=GRB.BINARY, name="x")
+        # Excluir ativos com retorno negativo (conservadorismo): limite
+        # superior 0 nas variáveis, que o presolve elimina sem restrições extras
+        permitidos = np.ones(n, dtype=bool)
+        excluir_negativos = self.config.get('excluir_retorno_negativo', True)
+        if excluir_negativos:
+            permitidos = mu >= 0
+            if not permitidos.all():
+                print(f"\nExcluindo {n - permitidos.sum()} ativos com retorno negativo")
+        
+        # Variáveis de decisão (vetores na ordem de self.metricas.index),
+        # nomeadas pelo ticker para que arquivos .mst sirvam entre execuções
+        tickers = self.metricas.index.astype(str)
+        self.x_vars = self.model.addMVar(
+            n, vtype=GRB.BINARY, ub=permitidos.astype(float),
+            name=[f"x[{t}]" for t in tickers]
+        )
         # y_vars: quantidade de lotes/ações compradas (inteiro não-negativo)
-        self.y_vars = self.model.addVars(I, vtype=GRB.INTEGER, lb=0, name="y")
-        
-        # Função objetivo: maximizar retorno percentual médio ponderado
-        # Retorno = Σ (retorno_% × investimento_i) / investimento_total
-        # Para linearizar, maximizamos Σ (retorno_% × investimento_i) diretamente
-        # pois investimento_total é aproximadamente fixo (uso total do orçamento)
-        self.model.setObjective(
-            gp.quicksum(mu[i] * preco[i] * self.y_vars[i] for i in I),
-            GRB.MAXIMIZE
+        self.y_vars = self.model.addMVar(
+            n, vtype=GRB.INTEGER, lb=0, ub=np.where(permitidos, GRB.INFINITY, 0.0),
+            name=[f"y[{t}]" for t in tickers]
         )
         
+        # Função objetivo: maximizar o retorno esperado em R$, Σ(μ_i × p_i × y_i).
+        # O investimento total não é fixo: I_tot é variável (0 <= I_tot <= B) e
+        # as médias ponderadas de risco e retorno são impostas exatamente,
+        # de forma linear, contra R × I_tot e T × I_tot (restrições abaixo)
+        self.model.setObjective((mu * preco) @ self.y_vars, GRB.MAXIMIZE)
+        
         # Restrições
-        # (eq:budget) Orçamento: soma dos gastos <= orçamento total
-        # Gasto = preço × quantidade
-        self.model.addConstr(
-            gp.quicksum(preco[i] * self.y_vars[i] for i in I) <= B,
-            name="orcamento"
-        )
+        # Investimento total como variável explícita: I_tot = Σ(p_i × y_i)
+        # (eq:budget) Orçamento: I_tot <= B (limite superior da variável)
+        self.I_tot = self.model.addVar(lb=0.0, ub=B, name="I_tot")
+        self.model.addConstr(preco @ self.y_vars == self.I_tot, name="orcamento")
         
         # (eq:risk) Risco: desvio-padrão médio ponderado <= R
-        # Σ(σ_i × invest_i) / invest_total <= R
-        # Linearizando: Σ(σ_i × p_i × y_i) <= R × Σ(p_i × y_i)
-        # Reorganizando: Σ(σ_i × p_i × y_i) - R × Σ(p_i × y_i) <= 0
-        self.model.addConstr(
-            gp.quicksum(sigma[i] * preco[i] * self.y_vars[i] for i in I) - R * gp.quicksum(preco[i] * self.y_vars[i] for i in I) <= 0,
-            name="risco"
-        )
+        # Σ(σ_i × invest_i) / I_tot <= R  =>  Σ(σ_i × p_i × y_i) <= R × I_tot
+        self.model.addConstr((sigma * preco) @ self.y_vars <= R * self.I_tot, name="risco")
         
         # (eq:return) Retorno mínimo: retorno médio ponderado >= T
-        # Σ(μ_i × invest_i) / invest_total >= T
-        # Linearizando: Σ(μ_i × p_i × y_i) >= T × Σ(p_i × y_i)
-        # Reorganizando: Σ(μ_i × p_i × y_i) - T × Σ(p_i × y_i) >= 0
-        self.model.addConstr(
-            gp.quicksum(mu[i] * preco[i] * self.y_vars[i] for i in I) - T * gp.quicksum(preco[i] * self.y_vars[i] for i in I) >= 0,
-            name="retorno_min"
-        )
+        # Σ(μ_i × invest_i) / I_tot >= T  =>  Σ(μ_i × p_i × y_i) >= T × I_tot
+        self.model.addConstr((mu * preco) @ self.y_vars >= T * self.I_tot, name="retorno_min")
         
         # (eq:card) Cardinalidade: número de ativos entre L_min e L_max
-        self.model.addConstr(
-            gp.quicksum(self.x_vars[i] for i in I) >= L_min,
-            name="min_ativos"
-        )
-        self.model.addConstr(
-            gp.quicksum(self.x_vars[i] for i in I) <= L_max,
-            name="max_ativos"
-        )
+        self.model.addConstr(self.x_vars.sum() >= L_min, name="min_ativos")
+        self.model.addConstr(self.x_vars.sum() <= L_max, name="max_ativos")
         
         # (eq:max_sector, eq:min_sector) Diversificação setorial
         if self.config.get('diversificacao_setor', False):
-            setores = self.metricas['setor'].unique()
+            setores, codigo_setor = self._setores, self._codigo_setor
             alpha_min = self.config.get('alpha_setor_min', 0.0)
             alpha_max = self.config.get('alpha_setor_max', 0.3)
             num_setores_min = self.config.get('num_setores_min', 1)
@@ -107,108 +169,204 @@ class PortfolioOptimizer:
             print(f"  Limite máximo por setor: {alpha_max:.1%}")
             print(f"  Mínimo de setores diferentes: {num_setores_min}")
             
-            # Variável binária: setor está sendo utilizado?
-            z_setor = self.model.addVars(setores, vtype=GRB.BINARY, name="z_setor")
+            # Matriz esparsa setor × ativo com o preço de cada ativo na linha
+            # do seu setor: M @ y = investimento em cada setor
+            M = sp.csr_matrix(
+                (preco, (codigo_setor, np.arange(n))),
+                shape=(len(setores), n)
+            )
+            investimento_setor = M @ self.y_vars
             
-            for s in setores:
-                ativos_setor = self.metricas[self.metricas['setor'] == s].index.tolist()
-                if ativos_setor:
-                    investimento_setor = gp.quicksum(preco[i] * self.y_vars[i] for i in ativos_setor)
-                    
-                    # (eq:max_sector) Limite máximo por setor
+            # Com no máximo 1 setor exigido e sem mínimo por setor, z_setor é
+            # desnecessário (L_min >= 1 ativo já cobre 1 setor): basta o limite
+            if num_setores_min <= 1 and alpha_min <= 0:
+                # (eq:max_sector) Limite máximo por setor
+                self.model.addConstr(
+                    investimento_setor <= alpha_max * B,
+                    name="setor_max"
+                )
+            else:
+                # Variável binária: setor está sendo utilizado?
+                z_setor = self.model.addMVar(len(setores), vtype=GRB.BINARY, name="z_setor")
+                
+                # (eq:max_sector) Limite máximo por setor e ativação de z_setor
+                # investimento_setor <= α_max × B × z_setor (se z=0, inv=0; se z=1,
+                # inv até α_max × B): big-M justo, uma linha por setor
+                self.model.addConstr(
+                    investimento_setor <= alpha_max * B * z_setor,
+                    name="setor_max"
+                )
+                
+                # Matriz de incidência setor × ativo: S @ x = ativos por setor
+                S = sp.csr_matrix(
+                    (np.ones(n), (codigo_setor, np.arange(n))),
+                    shape=(len(setores), n)
+                )
+                ativos_setor = np.asarray(S.sum(axis=1)).ravel()
+                
+                # z_setor só vale 1 se algum ativo do setor for selecionado; sem
+                # isso, setores vazios contariam no mínimo de setores (e o pool de
+                # soluções se encheria de cópias diferindo apenas em z_setor)
+                self.model.addConstr(z_setor <= S @ self.x_vars, name="setor_usado")
+                
+                # |I_s| × z_s >= Σ_{i∈s} x_i: z_s ativa com qualquer x do setor
+                # (reforça a relaxação linear)
+                self.model.addConstr(
+                    ativos_setor * z_setor >= S @ self.x_vars,
+                    name="setor_ativa"
+                )
+                
+                # (eq:min_sector) Se setor é usado, investir pelo menos alpha_min
+                if alpha_min > 0:
                     self.model.addConstr(
-                        investimento_setor <= alpha_max * B,
-                        name=f"setor_{s}_max"
+                        investimento_setor >= alpha_min * B * z_setor,
+                        name="setor_min"
                     )
-                    
-                    # Ativar z_setor se o setor for usado (investimento > 0)
-                    # investimento_setor <= B × z_setor (se z=0, inv=0; se z=1, inv pode ser até B)
+                
+                # Garantir número mínimo de setores diferentes
+                if num_setores_min > 1:
                     self.model.addConstr(
-                        investimento_setor <= B * z_setor[s],
-                        name=f"setor_{s}_ativa"
+                        z_setor.sum() >= num_setores_min,
+                        name="num_setores_min"
                     )
-                    
-                    # (eq:min_sector) Se setor é usado, investir pelo menos alpha_min
-                    if alpha_min > 0:
-                        self.model.addConstr(
-                            investimento_setor >= alpha_min * B * z_setor[s],
-                            name=f"setor_{s}_min"
-                        )
-            
-            # Garantir número mínimo de setores diferentes
-            self.model.addConstr(
-                gp.quicksum(z_setor[s] for s in setores) >= num_setores_min,
-                name="num_setores_min"
-            )
         
-        # Restrição de investimento máximo por ativo individual
+        # Investimento máximo por ativo individual: p_i × y_i <= β × B
+        # equivale (y inteiro) a y_i <= floor(β × B / p_i), absorvido no big-M
+        # da consistência abaixo
         max_ativo_pct = self.config.get('max_ativo_pct', 1.0)
         if max_ativo_pct < 1.0:
             print(f"\nLimite por ativo: {max_ativo_pct:.1%} do orçamento")
-            for i in I:
-                self.model.addConstr(
-                    preco[i] * self.y_vars[i] <= max_ativo_pct * B,
-                    name=f"max_ativo_{i}"
-                )
-        
-        # Excluir ativos com retorno negativo (conservadorismo)
-        excluir_negativos = self.config.get('excluir_retorno_negativo', True)
-        if excluir_negativos:
-            negativos = [i for i in I if mu[i] < 0]
-            if negativos:
-                print(f"\nExcluindo {len(negativos)} ativos com retorno negativo")
-                for i in negativos:
-                    self.model.addConstr(
-                        self.y_vars[i] == 0,
-                        name=f"no_negative_{i}"
-                    )
         
         # (eq:min_inv, eq:max_inv) Restrições de consistência
         # Se ativo não selecionado, não comprar ações (y = 0)
         # Se selecionado, comprar pelo menos 1 lote/ação
-        max_lotes = int(B / min(preco.values())) if preco else 1000  # Limite superior razoável
+        # Big-M por ativo: máximo de lotes que cabem no limite do ativo
+        # (mais justo que um M único calculado pelo ativo mais barato)
+        max_lotes = np.floor(min(max_ativo_pct, 1.0) * B / preco + 1e-9)
         
-        for i in I:
-            # (eq:max_inv) Se x=0, então y=0
-            self.model.addConstr(
-                self.y_vars[i] <= max_lotes * self.x_vars[i],
-                name=f"consistencia_max_{i}"
-            )
-            # (eq:min_inv) Se x=1, então y >= 1 (pelo menos 1 lote/ação)
-            self.model.addConstr(
-                self.y_vars[i] >= 1 * self.x_vars[i],
-                name=f"consistencia_min_{i}"
-            )
+        # (eq:max_inv, eq:max_ativo) Se x=0, então y=0; se x=1, y <= M_i
+        self.model.addConstr(
+            self.y_vars <= max_lotes * self.x_vars,
+            name="consistencia_max"
+        )
+        # (eq:min_inv) Se x=1, então y >= 1 (pelo menos 1 lote/ação)
+        self.model.addConstr(
+            self.y_vars >= self.x_vars,
+            name="consistencia_min"
+        )
         
         # (eq:binary, eq:nonneg) já definidas nas variáveis
         
+        # Desigualdades de cobertura (opcionais) derivadas do orçamento
+        if self.config.get('cortes_cobertura', False):
+            self._adicionar_cortes_cobertura()
+        
+        self.model.update()
         print(f"\nModelo: {self.model.NumVars} variáveis, {self.model.NumConstrs} restrições")
         
-    def otimizar(self, time_limit=300, mip_gap=0.0):
-        """Resolve o modelo."""
+    def _adicionar_cortes_cobertura(self, max_cortes=10):
+        """Adiciona desigualdades de cobertura estendida sobre x.
+        
+        Como y_i >= x_i, vale Σ p_i × x_i <= B. Para cada cobertura mínima C
+        (janela de ativos consecutivos na ordem decrescente de preço com
+        Σ p_i > B), a extensão E(C) = {i : p_i >= min_{j∈C} p_j} dá o corte
+        Σ_{i∈E(C)} x_i <= |C| - 1. Cortes com |C| - 1 >= L_max já são
+        implicados pela cardinalidade e não são adicionados.
+        """
+        B = self.config['orcamento']
+        L_max = self.config['num_ativos_max']
+        ordem = np.argsort(-self._preco, kind='stable')
+        acumulado = np.concatenate(([0.0], np.cumsum(self._preco[ordem])))
+        
+        # Para cada início k, menor fim tal que a janela [k, fim) excede B
+        fim = np.searchsorted(acumulado, acumulado[:-1] + B, side='right')
+        
+        cortes = {}
+        for k in np.flatnonzero(fim <= len(ordem)):
+            tamanho = int(fim[k] - k)
+            if tamanho - 1 < L_max:
+                # Mesmo |C|: a janela mais à direita tem a maior extensão
+                cortes[tamanho] = int(fim[k])
+        
+        for num, (tamanho, fim_ext) in enumerate(sorted(cortes.items())[:max_cortes]):
+            self.model.addConstr(
+                self.x_vars[ordem[:fim_ext]].sum() <= tamanho - 1,
+                name=f"cobertura_{num}"
+            )
+        print(f"\nCortes de cobertura: {min(len(cortes), max_cortes)}")
+    
+    def otimizar(self, time_limit=None, mip_gap=None, threads=None, method=None, mip_focus=1,
+                 warm_start=True, mip_start=None, explain_infeasible=False,
+                 pool_size=1, pool_gap=0.01):
+        """Resolve o modelo.
+        
+        time_limit, mip_gap: sobrescrevem os valores da configuração.
+        threads: número de threads do Gurobi (padrão: todos os núcleos).
+        method: algoritmo da relaxação raiz (padrão: conforme o regime de
+            tamanho do modelo; 2 = barreira).
+        mip_focus: 1 prioriza boas soluções viáveis; 2 foca em provar otimalidade.
+        warm_start: inicia o B&B com a carteira gulosa por Sharpe.
+        mip_start: arquivo .mst de uma execução anterior (p.ex. outro cenário)
+            usado no lugar da heurística; por padrão, o .mst salvo do próprio
+            cenário, se existir.
+        explain_infeasible: se inviável, calcula o IIS e lista as restrições.
+        pool_size: número de carteiras a guardar no pool de soluções; acima
+            de 1, busca sistematicamente as melhores alternativas até pool_gap
+            do ótimo (solucao['alternativas']).
+        """
         print("\n" + "="*60)
         print("RESOLVENDO MODELO")
         print("="*60)
         
-        # Configurações para garantir ótimo global
-        self.model.Params.TimeLimit = time_limit
-        self.model.Params.MIPGap = mip_gap              # 0.0 = buscar ótimo global
-        self.model.Params.MIPGapAbs = 0.0               # Gap absoluto = 0
-        self.model.Params.OptimalityTol = 1e-9          # Tolerância de otimalidade
-        self.model.Params.IntFeasTol = 1e-9             # Tolerância de integralidade
-        self.model.Params.FeasibilityTol = 1e-9         # Tolerância de viabilidade
-        self.model.Params.MIPFocus = 2                  # Foco em provar otimalidade
-        self.model.Params.Presolve = 2                  # Presolve agressivo
-        self.model.Params.Cuts = 2                      # Cortes agressivos
-        self.model.Params.Heuristics = 0.05             # Menos heurísticas, mais exato
-        self.model.Params.OutputFlag = 1
+        if threads is None:
+            threads = os.cpu_count() or 1
+        
+        # Apenas os parâmetros desta execução; os demais vêm do modelo/ambiente
+        if time_limit is not None:
+            self.model.Params.TimeLimit = time_limit
+        if mip_gap is not None:
+            self.model.Params.MIPGap = mip_gap
+        self.model.Params.MIPFocus = mip_focus
+        self.model.Params.Threads = threads
+        
+        # Parâmetros pelo regime de tamanho (CPU × memória)
+        regime, parametros = _regime_parametros(len(self.metricas))
+        if method is not None:
+            parametros['Method'] = method
+        for nome, valor in parametros.items():
+            self.model.setParam(nome, valor)
+        if threads >= 8:
+            self.model.Params.ConcurrentMIP = 2         # Duas buscas independentes em paralelo
+        if pool_size > 1:
+            self.model.Params.PoolSearchMode = 2        # k melhores soluções na mesma árvore
+            self.model.Params.PoolSolutions = pool_size
+            self.model.Params.PoolGap = pool_gap
+        else:
+            # Sem pool pedido: não guardar incumbentes intermediários do B&B
+            self.model.Params.PoolSearchMode = 0
+            self.model.Params.PoolSolutions = 1
         
         print("\nParâmetros Gurobi (busca ótimo global):")
-        print(f"  MIPGap: {mip_gap:.10f} (0 = ótimo global)")
-        print(f"  TimeLimit: {time_limit}s")
-        print(f"  MIPFocus: 2 (provar otimalidade)")
+        print(f"  MIPGap: {self.model.Params.MIPGap:.10f} (0 = ótimo global)")
+        print(f"  TimeLimit: {self.model.Params.TimeLimit:g}s")
+        print(f"  MIPFocus: {mip_focus}")
+        print(f"  Threads: {threads}")
+        print(f"  Regime: {regime} ({len(self.metricas)} ativos)")
+        
+        if warm_start:
+            if mip_start is None:
+                from . import config
+                cenario_nome = self.config.get('cenario_nome', 'moderado')
+                mip_start = config.obter_diretorios_cenario(cenario_nome)['carteira_mst']
+            self._definir_solucao_inicial(mip_start)
         
         self.model.optimize()
+        if self.model.Status == GRB.INF_OR_UNBD:
+            # Com presolve/reduções duais o Gurobi não distingue inviável de
+            # ilimitado: resolver de novo sem reduções duais para decidir
+            self.model.Params.DualReductions = 0
+            self.model.optimize()
+            self.model.Params.DualReductions = 1
         
         if self.model.Status == GRB.OPTIMAL:
             print("\nSolução ótima encontrada")
@@ -216,11 +374,16 @@ class PortfolioOptimizer:
             print("\n⏰ Limite de tempo atingido")
         elif self.model.Status == GRB.INFEASIBLE:
             print("\nModelo inviável")
-            self.model.computeIIS()
-            print("\nRestrições conflitantes:")
-            for c in self.model.getConstrs():
-                if c.IISConstr:
-                    print(f"  - {c.ConstrName}")
+            if explain_infeasible:
+                # IIS resolve uma sequência de LPs: só sob demanda
+                self.model.computeIIS()
+                restricoes = self.model.getConstrs()
+                nomes = self.model.getAttr('ConstrName', restricoes)
+                no_iis = self.model.getAttr('IISConstr', restricoes)
+                print("\nRestrições conflitantes:")
+                for nome, conflito in zip(nomes, no_iis):
+                    if conflito:
+                        print(f"  - {nome}")
             return None
         else:
             print(f"\nStatus desconhecido: {self.model.Status}")
@@ -229,62 +392,185 @@ class PortfolioOptimizer:
         self.extrair_solucao()
         return self.solucao
     
+    def _carteira_gulosa(self):
+        """Monta carteira viável gulosa por Sharpe (μ/σ), em lotes inteiros.
+        
+        Retorna o vetor de quantidades ou None se a heurística não atender
+        todas as restrições do modelo.
+        """
+        mu, sigma, preco = self._mu, self._sigma, self._preco
+        setores, codigo_setor = self._setores, self._codigo_setor
+        
+        B = self.config['orcamento']
+        R = self.config['risco_maximo']
+        T = self.config['retorno_minimo']
+        L_min = self.config['num_ativos_min']
+        L_max = self.config['num_ativos_max']
+        max_ativo = min(self.config.get('max_ativo_pct', 1.0), 1.0) * B
+        diversificar = self.config.get('diversificacao_setor', False)
+        alpha_max = self.config.get('alpha_setor_max', 0.3) if diversificar else 1.0
+        alpha_min = self.config.get('alpha_setor_min', 0.0) if diversificar else 0.0
+        
+        candidatos = sigma > 0
+        if self.config.get('excluir_retorno_negativo', True):
+            candidatos &= mu >= 0
+        ordem = np.flatnonzero(candidatos)
+        ordem = ordem[np.argsort(-(mu[ordem] / sigma[ordem]), kind='stable')]
+        
+        y = np.zeros(len(preco))
+        gasto_setor = np.zeros(len(setores))
+        
+        def alocar(i, limite):
+            # Lotes que cabem no limite, no orçamento e no setor, mantendo o
+            # risco médio ponderado da carteira parcial <= R
+            gasto = preco @ y
+            valor = min(
+                limite - preco[i] * y[i],
+                B - gasto,
+                alpha_max * B - gasto_setor[codigo_setor[i]],
+            )
+            if sigma[i] > R:
+                valor = min(valor, (R * gasto - (sigma * preco) @ y) / (sigma[i] - R))
+            lotes = np.floor(valor / preco[i] + 1e-9) if valor > 0 else 0.0
+            y[i] += lotes
+            gasto_setor[codigo_setor[i]] += lotes * preco[i]
+        
+        # 1ª passada: fatias iguais de B / L_min nos melhores ativos
+        fatia = min(max_ativo, B / max(L_min, 1))
+        for i in ordem:
+            if np.count_nonzero(y) >= L_max:
+                break
+            alocar(i, fatia)
+        
+        # 2ª passada: completar o orçamento até o limite por ativo
+        for i in ordem[y[ordem] > 0]:
+            alocar(i, max_ativo)
+        
+        selecionados = y > 0
+        gasto = preco @ y
+        setores_usados = gasto_setor > 0
+        if (selecionados.sum() < L_min
+                or (mu * preco) @ y < T * gasto
+                or (diversificar and
+                    setores_usados.sum() < self.config.get('num_setores_min', 1))
+                or np.any(gasto_setor[setores_usados] < alpha_min * B)):
+            return None
+        return y
+    
+    def _definir_solucao_inicial(self, arquivo_mst=None):
+        """Define a(s) solução(ões) inicial(is) (MIP start) do Gurobi.
+        
+        A carteira gulosa é sempre o start 0; o arquivo .mst de uma solução
+        anterior, quando existir, entra como start adicional. Assim um .mst
+        desatualizado (métricas ou limites alterados) não deixa o Gurobi
+        sem incumbente.
+        """
+        usar_mst = bool(arquivo_mst) and os.path.exists(arquivo_mst)
+        y = self._carteira_gulosa()
+        
+        self.model.NumStart = 2 if (usar_mst and y is not None) else 1
+        self.model.update()
+        self.model.Params.StartNumber = 0
+        if y is None:
+            print("\nHeurística gulosa não encontrou carteira viável")
+            self.x_vars.Start = GRB.UNDEFINED
+            self.y_vars.Start = GRB.UNDEFINED
+        else:
+            print(f"\nMIP start guloso: {int((y > 0).sum())} ativos")
+            self.x_vars.Start = (y > 0).astype(float)
+            self.y_vars.Start = y
+        self.model.update()
+        
+        if usar_mst:
+            self.model.Params.StartNumber = self.model.NumStart - 1
+            self.x_vars.Start = GRB.UNDEFINED
+            self.y_vars.Start = GRB.UNDEFINED
+            self.model.update()
+            self.model.read(arquivo_mst)
+            print(f"MIP start lido de: {arquivo_mst}")
+        self.model.Params.StartNumber = 0
+        self.model.update()
+    
+    def _montar_carteira(self, x_vals, y_vals):
+        """Monta DataFrame da carteira e médias ponderadas a partir de x e y."""
+        sel = x_vals > 0.5
+        
+        # Subconjunto selecionado extraído uma única vez (sem .loc por ativo)
+        subset = self.metricas[sel]
+        quantidade = np.rint(y_vals[sel]).astype(int)
+        preco = self._preco[sel]
+        mu = self._mu[sel]
+        sigma = self._sigma[sel]
+        investimento = quantidade * preco
+        
+        df_carteira = pd.DataFrame({
+            'ticker': subset.index.to_numpy(),
+            'nome': subset['nome_empresa'].to_numpy(),
+            'setor': subset['setor'].to_numpy(),
+            'preco': preco,
+            'quantidade': quantidade,
+            'investimento': investimento,
+            'retorno_esperado': mu,
+            'desvio_padrao': sigma,
+            'sharpe_ratio': subset['sharpe_ratio'].to_numpy(),
+        })
+        
+        investimento_total = investimento.sum()
+        
+        # Retorno e risco (desvio-padrão) médios ponderados pelo investimento
+        if investimento_total > 0:
+            retorno_total = mu @ investimento / investimento_total
+            risco_total = sigma @ investimento / investimento_total
+        else:
+            retorno_total = risco_total = 0
+        
+        return df_carteira, retorno_total, risco_total, investimento_total
+    
     def extrair_solucao(self):
         """Extrai solução do modelo otimizado."""
         print("\n" + "="*60)
         print("EXTRAÇÃO DA SOLUÇÃO")
         print("="*60)
         
-        ativos_selecionados = [i for i in self.metricas.index if self.x_vars[i].X > 0.5]
-        
-        carteira = []
-        for ativo in ativos_selecionados:
-            quantidade = int(round(self.y_vars[ativo].X))
-            preco_unitario = self.metricas.loc[ativo, 'preco_atual']
-            investimento = quantidade * preco_unitario
-            
-            carteira.append({
-                'ticker': ativo,
-                'nome': self.metricas.loc[ativo, 'nome_empresa'],
-                'setor': self.metricas.loc[ativo, 'setor'],
-                'preco': preco_unitario,
-                'quantidade': quantidade,
-                'investimento': investimento,
-                'retorno_esperado': self.metricas.loc[ativo, 'retorno_esperado'],
-                'desvio_padrao': self.metricas.loc[ativo, 'desvio_padrao'],
-                'sharpe_ratio': self.metricas.loc[ativo, 'sharpe_ratio']
+        df_carteira, retorno_total, risco_total, investimento_total = \
+            self._montar_carteira(self.x_vars.X, self.y_vars.X)
+        
+        # Carteiras alternativas do pool de soluções (SolutionNumber >= 1),
+        # só quando o pool foi pedido (PoolSearchMode 2); soluções que diferem
+        # só nas binárias de setor repetem a mesma carteira e são descartadas
+        alternativas = []
+        vistas = {np.rint(self.y_vars.X).astype(np.int64).tobytes()}
+        n_pool = self.model.SolCount if self.model.Params.PoolSearchMode == 2 else 1
+        for k in range(1, n_pool):
+            self.model.Params.SolutionNumber = k
+            y_k = self.y_vars.Xn
+            chave = np.rint(y_k).astype(np.int64).tobytes()
+            if chave in vistas:
+                continue
+            vistas.add(chave)
+            carteira_k, retorno_k, risco_k, investimento_k = \
+                self._montar_carteira(self.x_vars.Xn, y_k)
+            alternativas.append({
+                'carteira': carteira_k,
+                'num_ativos': len(carteira_k),
+                'retorno_total': retorno_k,
+                'risco_total': risco_k,
+                'investimento_total': investimento_k,
+                'funcao_objetivo': self.model.PoolObjVal,
             })
-        
-        df_carteira = pd.DataFrame(carteira)
-        
-        investimento_total = df_carteira['investimento'].sum()
-        
-        # Retorno percentual médio ponderado
-        retorno_total = sum(
-            self.metricas.loc[i, 'retorno_esperado'] * 
-            self.metricas.loc[i, 'preco_atual'] * 
-            self.y_vars[i].X
-            for i in ativos_selecionados
-        ) / investimento_total if investimento_total > 0 else 0
-        
-        # Risco (desvio-padrão) médio ponderado
-        risco_total = sum(
-            self.metricas.loc[i, 'desvio_padrao'] * 
-            self.metricas.loc[i, 'preco_atual'] * 
-            self.y_vars[i].X
-            for i in ativos_selecionados
-        ) / investimento_total if investimento_total > 0 else 0
+        self.model.Params.SolutionNumber = 0
         
         self.solucao = {
             'carteira': df_carteira,
-            'num_ativos': len(ativos_selecionados),
+            'num_ativos': len(df_carteira),
             'retorno_total': retorno_total,
             'risco_total': risco_total,
             'sharpe_carteira': retorno_total / risco_total if risco_total > 0 else 0,
             'investimento_total': investimento_total,
             'funcao_objetivo': self.model.ObjVal,
             'gap': self.model.MIPGap,
-            'tempo_exec': self.model.Runtime
+            'tempo_exec': self.model.Runtime,
+            'alternativas': alternativas,
         }
         
         print(f"\nResumo:")
@@ -295,11 +581,13 @@ class PortfolioOptimizer:
         print(f"  Investimento: R$ {self.solucao['investimento_total']:,.2f}")
         print(f"  Gap: {self.solucao['gap']:.2%}")
         print(f"  Tempo: {self.solucao['tempo_exec']:.2f}s")
+        if alternativas:
+            print(f"  Alternativas no pool: {len(alternativas)}")
         
         return self.solucao
     
     def salvar_solucao(self, arquivo=None):
-        """Salva carteira otimizada em CSV."""
+        """Salva carteira otimizada em CSV (e cópia Parquet para análises)."""
         if arquivo is None:
             from . import config
             cenario_nome = self.config.get('cenario_nome', 'moderado')
@@ -307,15 +595,83 @@ class PortfolioOptimizer:
             arquivo = dirs['carteira_csv']
         
         if self.solucao:
-            self.solucao['carteira'].to_csv(arquivo, index=False)
+            # Serialização colunar do Arrow (em C) para CSV e Parquet
+            tabela = pa.Table.from_pandas(self.solucao['carteira'], preserve_index=False)
+            pacsv.write_csv(tabela, arquivo)
+            pq.write_table(tabela, os.path.splitext(arquivo)[0] + '.parquet')
             print(f"\nCarteira salva: {arquivo}")
+            
+            # Solução em formato MIP start para reexecuções e outros cenários
+            arquivo_mst = os.path.splitext(arquivo)[0] + '.mst'
+            self.model.write(arquivo_mst)
+    
+    def dispose(self):
+        """Libera o modelo Gurobi (o ambiente do processo é mantido)."""
+        if self.model is not None:
+            self.model.dispose()
+            self.model = None
+            self.x_vars = self.y_vars = self.I_tot = None
     
     def executar_otimizacao_completa(self):
         """Executa pipeline completo de otimização."""
-        self.construir_modelo()
-        self.otimizar()
-        
-        if self.solucao:
-            self.salvar_solucao()
+        try:
+            self.construir_modelo()
+            self.otimizar()
+            
+            if self.solucao:
+                self.salvar_solucao()
+        finally:
+            self.dispose()
         
         return self.solucao
+
+
+def executar_cenario(metricas_df, config, threads=None):
+    """Constrói, resolve e salva a carteira de um cenário.
+    
+    Função de módulo (serializável) para rodar em processos separados; cada
+    processo usa seu próprio ambiente Gurobi (um por processo).
+    """
+    otimizador = PortfolioOptimizer(metricas_df, config)
+    try:
+        otimizador.construir_modelo()
+        otimizador.otimizar(threads=threads)
+        
+        if otimizador.solucao:
+            otimizador.salvar_solucao()
+    finally:
+        otimizador.dispose()
+    
+    return otimizador.solucao
+
+
+def otimizar_cenarios(metricas_df, cenarios, threads_por_modelo=2):
+    """Resolve vários cenários em paralelo, um processo por cenário.
+    
+    Um MIP pequeno raramente aproveita muitas threads: cada modelo usa
+    threads_por_modelo e os núcleos restantes atendem outros cenários.
+    Retorna {cenario: solucao} (None para cenários sem solução ou com erro).
+    """
+    from . import config
+    
+    cpus = os.cpu_count() or 1
+    threads = max(1, min(threads_por_modelo, cpus))
+    max_workers = max(1, min(len(cenarios), cpus // threads))
+    
+    # ChainMap/MappingProxyType não são serializáveis: enviar dict simples
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futuros = {
+            cenario: executor.submit(
+                executar_cenario, metricas_df, dict(config.obter_config(cenario)), threads
+            )
+            for cenario in cenarios
+        }
+        solucoes = {}
+        for cenario, futuro in futuros.items():
+            # Falha de um cenário (GurobiError, licença, ...) não derruba os demais
+            try:
+                solucoes[cenario] = futuro.result()
+            except Exception as e:
+                print(f"\nErro no cenário {cenario}: {str(e)}")
+                solucoes[cenario] = None
+        return solucoes
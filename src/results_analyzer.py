@@ -2,12 +2,110 @@
 Analisador de resultados da otimização com visualizações.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+
 import pandas as pd
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Apenas arquivos PNG: sem backend gráfico interativo
 import matplotlib.pyplot as plt
+from matplotlib.collections import PathCollection
+from matplotlib.path import Path
+from matplotlib.transforms import Affine2D, IdentityTransform
 import seaborn as sns
+import xlsxwriter
 from datetime import datetime
 
+plt.ioff()
+
+# Colunas numéricas da carteira usadas diretamente pelos gráficos
+_COLUNAS_NUMERICAS = ('investimento', 'retorno_esperado', 'desvio_padrao', 'sharpe_ratio')
+
+# Linhas do relatório em texto (campos nomeados, preenchidos com format_map)
+_LINHA_SETOR = ("{setor:<20} {num_ativos:>2} ativos  "
+                "R$ {investimento:>12,.2f}  ({percentual:>6.1%})\n").format_map
+_LINHA_ATIVO = ("{ticker:<8} {nome:<25.25} {setor:<15.15} {investimento:>12,.2f} "
+                "{pct:>6.1%} {retorno_esperado:>8.2%} {desvio_padrao:>8.4f} "
+                "{sharpe_ratio:>8.4f}\n").format_map
+
+
+def _escrever_aba(workbook, nome, df, index=False):
+    """Escreve um DataFrame numa aba, linha a linha e em ordem.
+    
+    O modo constant_memory do xlsxwriter só mantém a linha corrente em
+    memória, então cabeçalho e dados precisam ser gravados de cima para
+    baixo (o to_excel do pandas escreve coluna a coluna).
+    """
+    aba = workbook.add_worksheet(nome)
+    negrito = workbook.add_format({'bold': True})
+    
+    # Cabeçalho: um nível por linha (colunas MultiIndex), nome repetido
+    # apenas na primeira coluna de cada grupo, como o pandas faz
+    niveis = df.columns.nlevels
+    linha = 0
+    for nivel in range(niveis):
+        rotulos = df.columns.get_level_values(nivel)
+        anteriores = [None] + list(rotulos[:-1])
+        celulas = [r if (nivel == niveis - 1 or r != a) else None
+                   for r, a in zip(rotulos, anteriores)]
+        aba.write_row(linha, 1 if index else 0, celulas, negrito)
+        linha += 1
+    if index:
+        aba.write(linha, 0, df.index.name, negrito)
+        linha += 1
+    
+    dados = df.reset_index() if index else df
+    for valores in dados.to_numpy(dtype=object).tolist():
+        aba.write_row(linha, 0, valores)
+        linha += 1
+
+
+def _dispersao(ax, x, y, tamanhos, cores, linewidth):
+    """Dispersão como uma única PathCollection (círculos), sem o ax.scatter.
+    
+    Um só Path de marcador deslocado pelos offsets em coordenadas de dados;
+    cores pelo Sharpe (cmap RdYlGn), como no scatter original.
+    """
+    marcador = Path.unit_circle().transformed(Affine2D().scale(0.5))
+    pc = PathCollection(
+        [marcador], sizes=np.broadcast_to(tamanhos, np.shape(x)),
+        offsets=np.column_stack([x, y]), offset_transform=ax.transData,
+        transform=IdentityTransform(),
+        cmap='RdYlGn', alpha=0.7, edgecolors='black', linewidths=linewidth
+    )
+    pc.set_array(cores)
+    ax.add_collection(pc)
+    ax.autoscale_view()
+    return pc
+
+
+def _rotular(ax, rotulos, x, y, **kwargs):
+    """Anota os pontos, pulando rótulos que cairiam sobre outro já desenhado.
+    
+    Os limites do eixo são divididos numa grade de 2% em cada direção e só
+    o primeiro ponto de cada célula recebe rótulo.
+    """
+    (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+    celulas_x = np.floor((np.asarray(x) - x0) / (0.02 * (x1 - x0))).astype(int)
+    celulas_y = np.floor((np.asarray(y) - y0) / (0.02 * (y1 - y0))).astype(int)
+    ocupadas = set()
+    for rotulo, xi, yi, celula in zip(rotulos, x, y, zip(celulas_x, celulas_y)):
+        if celula in ocupadas:
+            continue
+        ocupadas.add(celula)
+        ax.annotate(rotulo, (xi, yi), **kwargs)
+
+
+def _recorte_tight(fig, pad=0.1):
+    """Cópia da região 'tight' (como bbox_inches='tight') da figura já desenhada."""
+    regiao = fig.get_tightbbox(fig.canvas.get_renderer()).padded(pad)
+    pixels = np.asarray(fig.canvas.buffer_rgba())
+    altura, largura = pixels.shape[:2]
+    x0, y0, x1, y1 = np.round(regiao.extents * fig.dpi).astype(int)
+    return pixels[max(altura - y1, 0):min(altura - y0, altura),
+                  max(x0, 0):min(x1, largura)].copy()
+
 
 class ResultsAnalyzer:
     """Analisa e visualiza resultados da otimização."""
@@ -15,10 +113,82 @@ class ResultsAnalyzer:
     def __init__(self, solucao, metricas_completas):
         self.solucao = solucao
         self.metricas = metricas_completas
-        self.carteira = solucao['carteira']
+        # Setor como Categorical: códigos inteiros para todas as agregações
+        self.carteira = solucao['carteira'].assign(
+            setor=lambda df: df['setor'].astype('category')
+        )
+        self._investimento_total = solucao['investimento_total']
+        
+        # Estrutura de arrays (um ndarray contíguo por coluna) para os
+        # gráficos, sem passar pelo pandas a cada chamada do matplotlib
+        self._colunas = {
+            col: np.ascontiguousarray(self.carteira[col].to_numpy(dtype=float))
+            for col in _COLUNAS_NUMERICAS
+        }
+        self._colunas['ticker'] = self.carteira['ticker'].to_numpy()
+        
+        # Códigos e rótulos de setor (categorias em ordem alfabética) usados
+        # nas agregações com np.bincount
+        setor = self.carteira['setor'].cat
+        self._setor_codes = setor.codes.to_numpy()
+        self._setor_labels = setor.categories
+        
+        # Cores dos gráficos calculadas uma vez por cenário
+        self._colors_viridis = plt.cm.viridis(np.linspace(0, 1, len(self.carteira)))
+        self._colors_setor = plt.cm.Set3(np.linspace(0, 1, len(self._setor_labels)))
+    
+    # A carteira não muda após o __init__: ordenação e agregações por setor
+    # são calculadas uma única vez e reaproveitadas por todas as saídas
+    
+    @cached_property
+    def carteira_por_investimento(self):
+        """Carteira ordenada por investimento (decrescente)."""
+        return self.carteira.sort_values('investimento', ascending=False)
+    
+    @cached_property
+    def participacao(self):
+        """Fração do investimento total em cada ativo (índice da carteira)."""
+        # Uma única divisão vetorizada do NumPy: um kernel @njit (como os do
+        # data_processor) não teria laço algum a acelerar aqui
+        return pd.Series(self._colunas['investimento'] / self._investimento_total,
+                         index=self.carteira.index, name='participacao')
+    
+    @cached_property
+    def agregados_setor(self):
+        """Todas as agregações por setor, numa única passada pelos códigos.
+        
+        Somas e contagens via np.bincount; as médias saem de soma/contagem.
+        Os demais consumidores (resumo, relatório, gráficos, Excel) apenas
+        selecionam colunas deste DataFrame.
+        """
+        n_setores = len(self._setor_labels)
+        num_ativos = np.bincount(self._setor_codes, minlength=n_setores)
+        
+        def soma(col):
+            return np.bincount(self._setor_codes, weights=self._colunas[col],
+                               minlength=n_setores)
         
-    def imprimir_resumo(self):
-        """Imprime resumo da carteira otimizada."""
+        investimento = soma('investimento')
+        return pd.DataFrame({
+            'investimento': investimento,
+            'investimento_medio': investimento / num_ativos,
+            'num_ativos': num_ativos,
+            'retorno_medio': soma('retorno_esperado') / num_ativos,
+            'risco_medio': soma('desvio_padrao') / num_ativos,
+            'sharpe_medio': soma('sharpe_ratio') / num_ativos,
+            'percentual': investimento / investimento.sum(),
+        }, index=pd.Index(self._setor_labels, name='setor'))
+    
+    @cached_property
+    def dist_setor(self):
+        """Investimento, número de ativos e percentual por setor."""
+        return self.agregados_setor[['investimento', 'num_ativos', 'percentual']]
+        
+    def imprimir_resumo(self, top_k=None):
+        """Imprime resumo da carteira otimizada.
+        
+        Com top_k, lista apenas os top_k maiores setores e ativos (por investimento).
+        """
         print("\n" + "="*80)
         print(" "*25 + "CARTEIRA OTIMIZADA")
         print("="*80)
@@ -33,28 +203,38 @@ class ResultsAnalyzer:
         print(f"  {'Tempo execução:':<25} {self.solucao['tempo_exec']:.2f}s")
         
         print(f"\nDISTRIBUIÇÃO POR SETOR:")
-        dist_setor = self.carteira.groupby('setor').agg({
-            'investimento': 'sum',
-            'ticker': 'count'
-        }).rename(columns={'ticker': 'num_ativos'})
-        dist_setor['percentual'] = dist_setor['investimento'] / dist_setor['investimento'].sum()
-        dist_setor = dist_setor.sort_values('investimento', ascending=False)
+        if top_k is None:
+            dist_setor = self.dist_setor.sort_values('investimento', ascending=False)
+        else:
+            dist_setor = self.dist_setor.nlargest(top_k, 'investimento')
         
-        for setor, row in dist_setor.iterrows():
-            print(f"  {setor:<20} {row['num_ativos']:>2} ativos  "
-                  f"R$ {row['investimento']:>12,.2f}  ({row['percentual']:>6.1%})")
+        for setor, num_ativos, investimento, percentual in dist_setor[
+                ['num_ativos', 'investimento', 'percentual']].itertuples(name=None):
+            print(f"  {setor:<20} {num_ativos:>2} ativos  "
+                  f"R$ {investimento:>12,.2f}  ({percentual:>6.1%})")
         
         print(f"\nATIVOS SELECIONADOS:")
         print(f"  {'#':<3} {'Ticker':<8} {'Empresa':<20} {'Setor':<15} "
               f"{'Invest.(R$)':>12} {'%':>6} {'Ret.':>7} {'Sharpe':>7}")
         print("  " + "-"*95)
         
-        carteira_sorted = self.carteira.sort_values('investimento', ascending=False)
-        for idx, row in enumerate(carteira_sorted.itertuples(), 1):
-            pct = row.investimento / self.solucao['investimento_total']
-            print(f"  {idx:<3} {row.ticker:<8} {row.nome[:20]:<20} {row.setor[:15]:<15} "
-                  f"{row.investimento:>12,.2f} {pct:>6.1%} {row.retorno_esperado:>7.2%} "
-                  f"{row.sharpe_ratio:>7.3f}")
+        # Colunas formatadas de uma vez (Series.map), fora do laço de impressão
+        # nlargest usa seleção parcial (heap), sem ordenar a carteira inteira
+        if top_k is None:
+            carteira = self.carteira_por_investimento
+        else:
+            carteira = self.carteira.nlargest(top_k, 'investimento')
+        fmt = pd.DataFrame({
+            'ticker': carteira['ticker'].str.ljust(8),
+            'nome': carteira['nome'].str.slice(0, 20).str.ljust(20),
+            'setor': carteira['setor'].str.slice(0, 15).str.ljust(15),
+            'invest': carteira['investimento'].map('{:>12,.2f}'.format),
+            'pct': self.participacao.reindex(carteira.index).map('{:>6.1%}'.format),
+            'ret': carteira['retorno_esperado'].map('{:>7.2%}'.format),
+            'sharpe': carteira['sharpe_ratio'].map('{:>7.3f}'.format),
+        })
+        for idx, campos in enumerate(fmt.itertuples(index=False, name=None), 1):
+            print(f"  {idx:<3} " + " ".join(campos))
         
         print("="*80 + "\n")
     
@@ -85,202 +265,145 @@ class ResultsAnalyzer:
         for metrica, cart, bench_val, diff in metricas:
             print(f"  {metrica:<20} {cart:>15} {bench_val:>15} {diff:>15}")
     
-    def gerar_graficos(self, arquivo=None, cenario='moderado'):
-        """Gera visualizações gráficas."""
-        if arquivo is None:
-            from . import config
-            dirs = config.obter_diretorios_cenario(cenario)
-            arquivo = dirs['grafico_png']
-        fig, axes = plt.subplots(2, 3, figsize=(20, 12))
-        fig.suptitle('Análise da Carteira Otimizada', fontsize=16, fontweight='bold')
-        
-        # 1. Investimento por ativo
-        ax1 = axes[0, 0]
-        carteira_sorted = self.carteira.sort_values('investimento', ascending=False)
-        colors = plt.cm.viridis(np.linspace(0, 1, len(carteira_sorted)))
-        ax1.barh(carteira_sorted['ticker'], carteira_sorted['investimento'], color=colors)
-        ax1.set_xlabel('Investimento (R$)', fontsize=11)
-        ax1.set_ylabel('Ativo', fontsize=11)
-        ax1.set_title('Distribuição do Investimento', fontsize=12, fontweight='bold')
-        ax1.grid(axis='x', alpha=0.3)
-        
-        # 2. Distribuição setorial
-        ax2 = axes[0, 1]
-        dist_setor = self.carteira.groupby('setor')['investimento'].sum().sort_values(ascending=False)
-        colors_setor = plt.cm.Set3(np.linspace(0, 1, len(dist_setor)))
-        wedges, texts, autotexts = ax2.pie(
-            dist_setor, labels=dist_setor.index, autopct='%1.1f%%',
-            colors=colors_setor, startangle=90
+    def _preparar_dados_graficos(self):
+        """Pré-calcula ordenações e agregações usadas pelos gráficos."""
+        self._carteira_sorted = self.carteira_por_investimento
+        self._dist_setor = self.dist_setor['investimento'].sort_values(ascending=False)
+        self._sharpe_sorted = self.carteira.sort_values('sharpe_ratio', ascending=True)
+        self._colors_sharpe = np.where(
+            self._sharpe_sorted['sharpe_ratio'].to_numpy() > 0, 'green', 'red'
+        )
+    
+    @staticmethod
+    def _tamanhos_fonte(individual):
+        """Tamanhos de fonte (rótulos, título, acréscimo das anotações) por figura."""
+        return (12, 14, 1) if individual else (11, 12, 0)
+    
+    def _plot_investimento(self, ax, individual=False):
+        """Barras horizontais do investimento por ativo."""
+        fs_rotulo, fs_titulo, _ = self._tamanhos_fonte(individual)
+        ax.barh(self._carteira_sorted['ticker'], self._carteira_sorted['investimento'],
+                color=self._colors_viridis)
+        ax.set_xlabel('Investimento (R$)', fontsize=fs_rotulo)
+        ax.set_ylabel('Ativo', fontsize=fs_rotulo)
+        titulo = 'Distribuição do Investimento por Ativo' if individual else 'Distribuição do Investimento'
+        ax.set_title(titulo, fontsize=fs_titulo, fontweight='bold')
+        ax.grid(axis='x', alpha=0.3)
+    
+    def _plot_setor(self, ax, individual=False):
+        """Pizza da distribuição setorial."""
+        _, fs_titulo, _ = self._tamanhos_fonte(individual)
+        wedges, texts, autotexts = ax.pie(
+            self._dist_setor, labels=self._dist_setor.index, autopct='%1.1f%%',
+            colors=self._colors_setor, startangle=90
         )
-        ax2.set_title('Distribuição por Setor', fontsize=12, fontweight='bold')
+        ax.set_title('Distribuição por Setor', fontsize=fs_titulo, fontweight='bold')
         for autotext in autotexts:
             autotext.set_color('white')
             autotext.set_fontweight('bold')
-        
-        # 3. Retorno vs Risco
-        ax3 = axes[1, 0]
-        scatter = ax3.scatter(
-            self.carteira['desvio_padrao'], self.carteira['retorno_esperado'],
-            s=self.carteira['investimento'] / 100,
-            c=self.carteira['sharpe_ratio'], cmap='RdYlGn',
-            alpha=0.7, edgecolors='black', linewidth=1
-        )
-        for _, row in self.carteira.iterrows():
-            ax3.annotate(row['ticker'], 
-                        (row['desvio_padrao'], row['retorno_esperado']),
-                        fontsize=8, alpha=0.7)
-        ax3.set_xlabel('Risco (Desvio-Padrão)', fontsize=11)
-        ax3.set_ylabel('Retorno Esperado', fontsize=11)
-        ax3.set_title('Retorno vs Risco', fontsize=12, fontweight='bold')
-        ax3.grid(True, alpha=0.3)
-        plt.colorbar(scatter, ax=ax3, label='Sharpe Ratio')
-        
-        # 4. Sharpe Ratio
-        ax4 = axes[1, 1]
-        carteira_sharpe = self.carteira.sort_values('sharpe_ratio', ascending=True)
-        colors_sharpe = ['green' if x > 0 else 'red' for x in carteira_sharpe['sharpe_ratio']]
-        ax4.barh(carteira_sharpe['ticker'], carteira_sharpe['sharpe_ratio'], color=colors_sharpe)
-        ax4.set_xlabel('Sharpe Ratio', fontsize=11)
-        ax4.set_ylabel('Ativo', fontsize=11)
-        ax4.set_title('Sharpe Ratio por Ativo', fontsize=12, fontweight='bold')
-        ax4.axvline(x=0, color='black', linestyle='--', linewidth=0.8)
-        ax4.grid(axis='x', alpha=0.3)
-        
-        # 5. Investimento vs Retorno Esperado
-        ax5 = axes[1, 2]
-        scatter2 = ax5.scatter(
-            self.carteira['investimento'], 
-            self.carteira['retorno_esperado'],
-            s=200,
-            c=self.carteira['sharpe_ratio'], 
-            cmap='RdYlGn',
-            alpha=0.7, 
-            edgecolors='black', 
-            linewidth=1.5
-        )
-        for _, row in self.carteira.iterrows():
-            ax5.annotate(row['ticker'], 
-                        (row['investimento'], row['retorno_esperado']),
-                        fontsize=9, alpha=0.8, fontweight='bold')
-        ax5.set_xlabel('Investimento (R$)', fontsize=11)
-        ax5.set_ylabel('Retorno Esperado (%)', fontsize=11)
-        ax5.set_title('Investimento vs Retorno Esperado', fontsize=12, fontweight='bold')
-        ax5.grid(True, alpha=0.3)
+    
+    def _plot_retorno_risco(self, ax, individual=False):
+        """Dispersão retorno × risco, com tamanho pelo investimento."""
+        fs_rotulo, fs_titulo, extra = self._tamanhos_fonte(individual)
+        d = self._colunas
+        scatter = _dispersao(ax, d['desvio_padrao'], d['retorno_esperado'],
+                             d['investimento'] / 100, d['sharpe_ratio'], linewidth=1)
+        _rotular(ax, d['ticker'], d['desvio_padrao'], d['retorno_esperado'],
+                 fontsize=8 + extra, alpha=0.7)
+        ax.set_xlabel('Risco (Desvio-Padrão)', fontsize=fs_rotulo)
+        ax.set_ylabel('Retorno Esperado', fontsize=fs_rotulo)
+        ax.set_title('Retorno vs Risco', fontsize=fs_titulo, fontweight='bold')
+        ax.grid(True, alpha=0.3)
+        ax.figure.colorbar(scatter, ax=ax, label='Sharpe Ratio')
+    
+    def _plot_sharpe(self, ax, individual=False):
+        """Barras horizontais do Sharpe ratio por ativo."""
+        fs_rotulo, fs_titulo, _ = self._tamanhos_fonte(individual)
+        ax.barh(self._sharpe_sorted['ticker'], self._sharpe_sorted['sharpe_ratio'],
+                color=self._colors_sharpe)
+        ax.set_xlabel('Sharpe Ratio', fontsize=fs_rotulo)
+        ax.set_ylabel('Ativo', fontsize=fs_rotulo)
+        ax.set_title('Sharpe Ratio por Ativo', fontsize=fs_titulo, fontweight='bold')
+        ax.axvline(x=0, color='black', linestyle='--', linewidth=0.8)
+        ax.grid(axis='x', alpha=0.3)
+    
+    def _plot_inv_ret(self, ax, individual=False):
+        """Dispersão investimento × retorno esperado."""
+        fs_rotulo, fs_titulo, extra = self._tamanhos_fonte(individual)
+        d = self._colunas
+        scatter = _dispersao(ax, d['investimento'], d['retorno_esperado'],
+                             200, d['sharpe_ratio'], linewidth=1.5)
+        _rotular(ax, d['ticker'], d['investimento'], d['retorno_esperado'],
+                 fontsize=9 + extra, alpha=0.8, fontweight='bold')
+        ax.set_xlabel('Investimento (R$)', fontsize=fs_rotulo)
+        ax.set_ylabel('Retorno Esperado (%)', fontsize=fs_rotulo)
+        ax.set_title('Investimento vs Retorno Esperado', fontsize=fs_titulo, fontweight='bold')
+        ax.grid(True, alpha=0.3)
         
         # Formatar eixo Y como percentual
-        ax5.yaxis.set_major_formatter(plt.FuncFormatter(lambda y, _: f'{y:.1%}'))
+        ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda y, _: f'{y:.1%}'))
+        ax.figure.colorbar(scatter, ax=ax, label='Sharpe Ratio')
+    
+    def gerar_graficos(self, arquivo=None, cenario='moderado'):
+        """Gera visualizações gráficas.
         
-        # Adicionar colorbar
-        plt.colorbar(scatter2, ax=ax5, label='Sharpe Ratio')
+        Retorna a lista de arquivos PNG gravados (painel-resumo primeiro);
+        as figuras são fechadas aqui.
+        """
+        from . import config
+        dirs = config.obter_diretorios_cenario(cenario)
+        if arquivo is None:
+            arquivo = dirs['grafico_png']
+        
+        # Dados compartilhados entre a figura combinada e as individuais
+        self._preparar_dados_graficos()
+        paineis = [
+            (self._plot_investimento, (0, 0), "01_investimento_por_ativo.png"),
+            (self._plot_setor, (0, 1), "02_distribuicao_setorial.png"),
+            (self._plot_retorno_risco, (1, 0), "03_retorno_vs_risco.png"),
+            (self._plot_sharpe, (1, 1), "04_sharpe_ratio.png"),
+            (self._plot_inv_ret, (1, 2), "05_investimento_vs_retorno.png"),
+        ]
+        
+        fig, axes = plt.subplots(2, 3, figsize=(20, 12))
+        fig.suptitle('Análise da Carteira Otimizada', fontsize=16, fontweight='bold')
+        for plotar, posicao, _ in paineis:
+            plotar(axes[posicao])
         
-        plt.tight_layout()
-        plt.savefig(arquivo, dpi=300, bbox_inches='tight')
+        # Painel-resumo em 150 dpi; tight_layout já ajusta as margens, então
+        # dispensa o bbox_inches='tight' (que renderiza a figura duas vezes)
+        fig.tight_layout()
+        fig.canvas.print_figure(arquivo, dpi=150)
+        plt.close(fig)  # Libera o buffer da figura combinada antes das individuais
         print(f"\nGráficos salvos: {arquivo}")
         
-        # Salvar gráficos individuais
-        import os
-        from . import config
-        dirs = config.obter_diretorios_cenario(cenario)
+        # Gráficos individuais numa única figura 10x8 reaproveitada: cada um é
+        # desenhado em 300 dpi na thread principal e só o recorte 'tight'
+        # (cópia) vai para a compressão PNG, que libera o GIL e roda em
+        # paralelo com o desenho do gráfico seguinte
         graficos_dir = dirs['dir']
-        
-        # 1. Salvar gráfico de investimento por ativo
-        fig1, ax_temp = plt.subplots(figsize=(10, 8))
-        carteira_sorted = self.carteira.sort_values('investimento', ascending=False)
-        colors = plt.cm.viridis(np.linspace(0, 1, len(carteira_sorted)))
-        ax_temp.barh(carteira_sorted['ticker'], carteira_sorted['investimento'], color=colors)
-        ax_temp.set_xlabel('Investimento (R$)', fontsize=12)
-        ax_temp.set_ylabel('Ativo', fontsize=12)
-        ax_temp.set_title('Distribuição do Investimento por Ativo', fontsize=14, fontweight='bold')
-        ax_temp.grid(axis='x', alpha=0.3)
-        plt.tight_layout()
-        plt.savefig(f"{graficos_dir}01_investimento_por_ativo.png", dpi=300, bbox_inches='tight')
-        plt.close(fig1)
-        
-        # 2. Salvar gráfico de distribuição setorial
-        fig2, ax_temp = plt.subplots(figsize=(10, 8))
-        dist_setor = self.carteira.groupby('setor')['investimento'].sum().sort_values(ascending=False)
-        colors_setor = plt.cm.Set3(np.linspace(0, 1, len(dist_setor)))
-        wedges, texts, autotexts = ax_temp.pie(
-            dist_setor, labels=dist_setor.index, autopct='%1.1f%%',
-            colors=colors_setor, startangle=90
-        )
-        ax_temp.set_title('Distribuição por Setor', fontsize=14, fontweight='bold')
-        for autotext in autotexts:
-            autotext.set_color('white')
-            autotext.set_fontweight('bold')
-        plt.tight_layout()
-        plt.savefig(f"{graficos_dir}02_distribuicao_setorial.png", dpi=300, bbox_inches='tight')
-        plt.close(fig2)
-        
-        # 3. Salvar gráfico de retorno vs risco
-        fig3, ax_temp = plt.subplots(figsize=(10, 8))
-        scatter_temp = ax_temp.scatter(
-            self.carteira['desvio_padrao'], self.carteira['retorno_esperado'],
-            s=self.carteira['investimento'] / 100,
-            c=self.carteira['sharpe_ratio'], cmap='RdYlGn',
-            alpha=0.7, edgecolors='black', linewidth=1
-        )
-        for _, row in self.carteira.iterrows():
-            ax_temp.annotate(row['ticker'], 
-                        (row['desvio_padrao'], row['retorno_esperado']),
-                        fontsize=9, alpha=0.7)
-        ax_temp.set_xlabel('Risco (Desvio-Padrão)', fontsize=12)
-        ax_temp.set_ylabel('Retorno Esperado', fontsize=12)
-        ax_temp.set_title('Retorno vs Risco', fontsize=14, fontweight='bold')
-        ax_temp.grid(True, alpha=0.3)
-        plt.colorbar(scatter_temp, ax=ax_temp, label='Sharpe Ratio')
-        plt.tight_layout()
-        plt.savefig(f"{graficos_dir}03_retorno_vs_risco.png", dpi=300, bbox_inches='tight')
-        plt.close(fig3)
-        
-        # 4. Salvar gráfico de Sharpe Ratio
-        fig4, ax_temp = plt.subplots(figsize=(10, 8))
-        carteira_sharpe = self.carteira.sort_values('sharpe_ratio', ascending=True)
-        colors_sharpe = ['green' if x > 0 else 'red' for x in carteira_sharpe['sharpe_ratio']]
-        ax_temp.barh(carteira_sharpe['ticker'], carteira_sharpe['sharpe_ratio'], color=colors_sharpe)
-        ax_temp.set_xlabel('Sharpe Ratio', fontsize=12)
-        ax_temp.set_ylabel('Ativo', fontsize=12)
-        ax_temp.set_title('Sharpe Ratio por Ativo', fontsize=14, fontweight='bold')
-        ax_temp.axvline(x=0, color='black', linestyle='--', linewidth=0.8)
-        ax_temp.grid(axis='x', alpha=0.3)
-        plt.tight_layout()
-        plt.savefig(f"{graficos_dir}04_sharpe_ratio.png", dpi=300, bbox_inches='tight')
-        plt.close(fig4)
-        
-        # 5. Salvar gráfico de investimento vs retorno
-        fig5, ax_temp = plt.subplots(figsize=(10, 8))
-        scatter2_temp = ax_temp.scatter(
-            self.carteira['investimento'], 
-            self.carteira['retorno_esperado'],
-            s=200,
-            c=self.carteira['sharpe_ratio'], 
-            cmap='RdYlGn',
-            alpha=0.7, 
-            edgecolors='black', 
-            linewidth=1.5
-        )
-        for _, row in self.carteira.iterrows():
-            ax_temp.annotate(row['ticker'], 
-                        (row['investimento'], row['retorno_esperado']),
-                        fontsize=10, alpha=0.8, fontweight='bold')
-        ax_temp.set_xlabel('Investimento (R$)', fontsize=12)
-        ax_temp.set_ylabel('Retorno Esperado (%)', fontsize=12)
-        ax_temp.set_title('Investimento vs Retorno Esperado', fontsize=14, fontweight='bold')
-        ax_temp.grid(True, alpha=0.3)
-        ax_temp.yaxis.set_major_formatter(plt.FuncFormatter(lambda y, _: f'{y:.1%}'))
-        plt.colorbar(scatter2_temp, ax=ax_temp, label='Sharpe Ratio')
-        plt.tight_layout()
-        plt.savefig(f"{graficos_dir}05_investimento_vs_retorno.png", dpi=300, bbox_inches='tight')
-        plt.close(fig5)
+        arquivos = [arquivo]
+        fig_ind = plt.figure(figsize=(10, 8), dpi=300)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futuros = []
+            for plotar, _, nome in paineis:
+                fig_ind.clf()
+                plotar(fig_ind.add_subplot(), individual=True)
+                fig_ind.tight_layout()
+                fig_ind.canvas.draw()
+                caminho = f"{graficos_dir}{nome}"
+                futuros.append(executor.submit(plt.imsave, caminho,
+                                               _recorte_tight(fig_ind), dpi=300))
+                arquivos.append(caminho)
+            for futuro in futuros:
+                futuro.result()
+        plt.close(fig_ind)
         
         print(f"   Gráficos individuais salvos em: {graficos_dir}")
-        print(f"     - 01_investimento_por_ativo.png")
-        print(f"     - 02_distribuicao_setorial.png")
-        print(f"     - 03_retorno_vs_risco.png")
-        print(f"     - 04_sharpe_ratio.png")
-        print(f"     - 05_investimento_vs_retorno.png")
+        for _, _, nome in paineis:
+            print(f"     - {nome}")
         
-        return fig
+        return arquivos
     
     def exportar_relatorio(self, arquivo=None, cenario='moderado'):
         """Exporta relatório completo em texto."""
@@ -288,63 +411,70 @@ class ResultsAnalyzer:
             from . import config
             dirs = config.obter_diretorios_cenario(cenario)
             arquivo = dirs['relatorio_txt']
-        with open(arquivo, 'w', encoding='utf-8') as f:
-            f.write("="*80 + "\n")
-            f.write(" "*20 + "RELATÓRIO DE OTIMIZAÇÃO DE CARTEIRA\n")
-            f.write(" "*25 + f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
-            f.write("="*80 + "\n\n")
-            
-            f.write("MÉTRICAS GERAIS\n" + "-"*80 + "\n")
-            f.write(f"Ativos: {self.solucao['num_ativos']}\n")
-            f.write(f"Retorno: {self.solucao['retorno_total']:.4f} ({self.solucao['retorno_total']:.2%})\n")
-            f.write(f"Risco: {self.solucao['risco_total']:.4f}\n")
-            f.write(f"Sharpe: {self.solucao['sharpe_carteira']:.4f}\n")
-            f.write(f"Investimento: R$ {self.solucao['investimento_total']:,.2f}\n")
-            f.write(f"Gap: {self.solucao['gap']:.2%}\n")
-            f.write(f"Tempo: {self.solucao['tempo_exec']:.2f}s\n\n")
-            
-            f.write("DISTRIBUIÇÃO SETORIAL\n" + "-"*80 + "\n")
-            dist_setor = self.carteira.groupby('setor').agg({
-                'investimento': 'sum', 'ticker': 'count'
-            }).rename(columns={'ticker': 'num_ativos'})
-            dist_setor['percentual'] = dist_setor['investimento'] / dist_setor['investimento'].sum()
-            
-            for setor, row in dist_setor.iterrows():
-                f.write(f"{setor:<20} {row['num_ativos']:>2} ativos  "
-                       f"R$ {row['investimento']:>12,.2f}  ({row['percentual']:>6.1%})\n")
-            
-            f.write("\nDETALHAMENTO DOS ATIVOS\n" + "-"*80 + "\n")
-            f.write(f"{'Ticker':<8} {'Empresa':<25} {'Setor':<15} {'Invest.':<12} "
-                   f"{'%':<6} {'Retorno':<8} {'Risco':<8} {'Sharpe':<8}\n")
-            f.write("-"*80 + "\n")
+        # Linhas acumuladas em memória e gravadas numa única escrita
+        linhas = [
+            "="*80 + "\n",
+            " "*20 + "RELATÓRIO DE OTIMIZAÇÃO DE CARTEIRA\n",
+            " "*25 + f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n",
+            "="*80 + "\n\n",
             
-            for _, row in self.carteira.sort_values('investimento', ascending=False).iterrows():
-                pct = row['investimento'] / self.solucao['investimento_total']
-                f.write(f"{row['ticker']:<8} {row['nome'][:25]:<25} {row['setor'][:15]:<15} "
-                       f"{row['investimento']:>12,.2f} {pct:>6.1%} {row['retorno_esperado']:>8.2%} "
-                       f"{row['desvio_padrao']:>8.4f} {row['sharpe_ratio']:>8.4f}\n")
+            "MÉTRICAS GERAIS\n" + "-"*80 + "\n",
+            f"Ativos: {self.solucao['num_ativos']}\n",
+            f"Retorno: {self.solucao['retorno_total']:.4f} ({self.solucao['retorno_total']:.2%})\n",
+            f"Risco: {self.solucao['risco_total']:.4f}\n",
+            f"Sharpe: {self.solucao['sharpe_carteira']:.4f}\n",
+            f"Investimento: R$ {self.solucao['investimento_total']:,.2f}\n",
+            f"Gap: {self.solucao['gap']:.2%}\n",
+            f"Tempo: {self.solucao['tempo_exec']:.2f}s\n\n",
             
-            f.write("\n" + "="*80 + "\n")
+            "DISTRIBUIÇÃO SETORIAL\n" + "-"*80 + "\n",
+        ]
+        
+        linhas.extend(map(_LINHA_SETOR, self.dist_setor.reset_index().to_dict('records')))
+        
+        linhas.append("\nDETALHAMENTO DOS ATIVOS\n" + "-"*80 + "\n")
+        linhas.append(f"{'Ticker':<8} {'Empresa':<25} {'Setor':<15} {'Invest.':<12} "
+                      f"{'%':<6} {'Retorno':<8} {'Risco':<8} {'Sharpe':<8}\n")
+        linhas.append("-"*80 + "\n")
+        
+        ativos = self.carteira_por_investimento[
+            ['ticker', 'nome', 'setor', 'investimento',
+             'retorno_esperado', 'desvio_padrao', 'sharpe_ratio']
+        ].assign(pct=self.participacao)
+        linhas.extend(map(_LINHA_ATIVO, ativos.to_dict('records')))
+        
+        linhas.append("\n" + "="*80 + "\n")
+        
+        with open(arquivo, 'w', encoding='utf-8') as f:
+            f.writelines(linhas)
         
         print(f"\nRelatório salvo: {arquivo}")
     
+    def _aba_setores(self):
+        """Aba 'Setores' do Excel, com os cabeçalhos (coluna, agregação) usuais."""
+        colunas = {
+            ('investimento', 'sum'): 'investimento',
+            ('investimento', 'mean'): 'investimento_medio',
+            ('ticker', 'count'): 'num_ativos',
+            ('retorno_esperado', 'mean'): 'retorno_medio',
+            ('desvio_padrao', 'mean'): 'risco_medio',
+            ('sharpe_ratio', 'mean'): 'sharpe_medio',
+        }
+        aba = self.agregados_setor[list(colunas.values())]
+        return aba.set_axis(pd.MultiIndex.from_tuples(colunas), axis=1)
+    
     def salvar_excel(self, arquivo=None, cenario='moderado'):
         """Salva análise em Excel com múltiplas abas."""
         if arquivo is None:
             from . import config
             dirs = config.obter_diretorios_cenario(cenario)
             arquivo = dirs['analise_xlsx']
-        with pd.ExcelWriter(arquivo, engine='openpyxl') as writer:
-            self.carteira.to_excel(writer, sheet_name='Carteira', index=False)
-            
-            dist_setor = self.carteira.groupby('setor').agg({
-                'investimento': ['sum', 'mean'],
-                'ticker': 'count',
-                'retorno_esperado': 'mean',
-                'desvio_padrao': 'mean',
-                'sharpe_ratio': 'mean'
-            })
-            dist_setor.to_excel(writer, sheet_name='Setores')
+        # xlsxwriter em modo constant_memory grava as linhas em ordem direto
+        # no disco, sem montar a árvore XML da planilha inteira em memória
+        with xlsxwriter.Workbook(arquivo, {'constant_memory': True,
+                                           'nan_inf_to_errors': True}) as workbook:
+            _escrever_aba(workbook, 'Carteira', self.carteira)
+            _escrever_aba(workbook, 'Setores', self._aba_setores(), index=True)
             
             metricas_gerais = pd.DataFrame({
                 'Métrica': ['Ativos', 'Retorno', 'Risco', 'Sharpe', 
@@ -354,6 +484,6 @@ class ResultsAnalyzer:
                          self.solucao['investimento_total'], self.solucao['gap'],
                          self.solucao['tempo_exec']]
             })
-            metricas_gerais.to_excel(writer, sheet_name='Métricas', index=False)
+            _escrever_aba(workbook, 'Métricas', metricas_gerais)
         
         print(f"\nExcel salvo: {arquivo}")